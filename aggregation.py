@@ -0,0 +1,203 @@
+import time
+from pyomo.core import Objective, Constraint
+from pyomo.core import minimize, value
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.repn import generate_standard_repn
+import numpy as np
+
+from model import microgrid_model, microgrid_data_input, solve_model, microgrid_results
+from matrix_model import lp_constraints, n_constraints
+
+
+
+# Representative-day aggregation of microgrid_model for fast screening.
+#
+# The complete days of the horizon are clustered (k-means on the daily profiles
+# of the time series) and every cluster is represented by its mean day or by its
+# medoid, the real day closest to the cluster centre. The reduced LP holds the
+# k representative days one after the other:
+#   - every period cost is weighted by the number of days of its cluster
+#     (dt * weight), costs charged once per horizon (power contract) are not
+#   - the soc of every representative day is linked to itself: the day starts
+#     at the level it ends with, so no energy is moved between days
+# compare_aggregation solves both the reduced and the full-resolution LP and
+# reports the objective and design errors.
+#
+# Example
+# agg = representative_days(microgrid_data_input(data), k=8)
+# model_instance = aggregated_model(agg)
+# solve_model(model_instance, solver)
+# report = compare_aggregation(data, k=8, solver=solver)
+
+
+PERIODS_PER_DAY = 96
+
+# Daily profiles used for clustering
+TIME_SERIES = ['generation', 'demand', 'energy_price_buy', 'energy_price_sell']
+
+
+
+def _kmeans(X, k, seed=0, max_iter=100):
+
+    # k-means++ start and Lloyd iterations, returns (centres, labels)
+    rng = np.random.default_rng(seed)
+    centres = X[[rng.integers(len(X))]]
+    while len(centres) < k:
+        d2 = ((X[:, None, :] - centres[None, :, :])**2).sum(axis=-1).min(axis=1)
+        p = d2/d2.sum() if d2.sum() > 0 else None
+        centres = np.vstack((centres, X[rng.choice(len(X), p=p)]))
+
+    labels = None
+    for i in range(max_iter):
+        new = ((X[:, None, :] - centres[None, :, :])**2).sum(axis=-1).argmin(axis=1)
+        if labels is not None and np.array_equal(new, labels):
+            break
+        labels = new
+        for c in range(k):
+            if np.any(labels == c):
+                centres[c] = X[labels == c].mean(axis=0)
+
+    return centres, labels
+
+
+
+def representative_days(model_data, k, periods_per_day=PERIODS_PER_DAY, seed=0, representation='mean'):
+
+    # representation='mean': every cluster by its mean day (keeps the energy totals),
+    # 'medoid': by the real day closest to the cluster centre (keeps real peaks)
+    if representation not in ('mean', 'medoid'):
+        raise ValueError("Unknown representation '%s', use 'mean' or 'medoid'" % representation)
+
+
+    d = model_data[None]
+    n_days = len(d['T'])//periods_per_day
+    if not 0 < k <= n_days:
+        raise ValueError("k must be between 1 and the %d complete days of the horizon" % n_days)
+
+    # Daily profiles, every varying series scaled to unit standard deviation
+    profiles = [np.asarray(d[name], dtype=float)[:n_days*periods_per_day].reshape(n_days, periods_per_day)
+                for name in TIME_SERIES]
+    X = np.hstack([p/p.std() if p.std() > 1e-9*np.abs(p).max() else p for p in profiles])
+
+    centres, labels = _kmeans(X, k, seed)
+
+    # Medoid of every non-empty cluster, in calendar order
+    clusters = [c for c in range(k) if np.any(labels == c)]
+    medoids = []
+    for c in clusters:
+        members = np.flatnonzero(labels == c)
+        medoids.append(members[((X[members] - centres[c])**2).sum(axis=1).argmin()])
+    order = np.argsort(medoids)
+    days = np.array(medoids)[order]
+    position = {clusters[j]: i for i, j in enumerate(order)}
+    assignment = np.array([position[c] for c in labels])
+    weights = np.bincount(assignment, minlength=len(days)).astype(float)
+
+
+    # Reduced model data: the representative days one after the other
+    periods = (days[:, None]*periods_per_day + np.arange(periods_per_day)).ravel()
+    reduced = dict(d)
+    reduced['T'] = np.arange(1, len(periods)+1)
+    for name, x in d.items():
+        if name != 'T' and np.ndim(x) == 1 and len(x) == len(d['T']):
+            x = np.asarray(x)
+            if representation == 'mean' and x.dtype.kind == 'f':
+                daily = x[:n_days*periods_per_day].reshape(n_days, periods_per_day)
+                reduced[name] = np.vstack([daily[assignment == i].mean(axis=0) for i in range(len(days))]).ravel()
+            else:
+                reduced[name] = x[periods]
+
+    # Profile error of the clustering: RMSE between every day and its representative
+    error = dict()
+    for name, p in zip(TIME_SERIES, profiles):
+        represented = reduced[name].reshape(len(days), periods_per_day)[assignment]
+        error[name] = float(np.sqrt(((p - represented)**2).mean()))
+
+    return {'model_data': {None: reduced}, 'days': days, 'weights': weights, 'assignment': assignment,
+            'periods_per_day': periods_per_day, 'n_days': n_days, 'profile_error': error}
+
+
+
+def aggregated_model(agg, builder='rules'):
+
+
+    # The rows of the matrix builder are changed below, so they are added as Pyomo constraints
+    model_instance = lp_constraints(microgrid_model(agg['model_data'], builder=builder))
+    m = model_instance
+    T = list(m.T)
+    ppd = agg['periods_per_day']
+    weight = dict(zip(T, np.repeat(agg['weights'], ppd).tolist()))
+
+
+    # Soc of every day linked to itself instead of to the previous representative day
+    if m.BEL[T[-1]].fixed:
+        m.BEL[T[-1]].unfix()
+
+    first, last = T[::ppd], T[ppd-1::ppd]
+
+    d = agg['model_data'][None]
+
+    def day_soc(m, i):
+        t = first[i]
+        return m.BEL[t] - m.BEL[last[i]] == d['battery_efficiency_charge']*m.B_IN[t]*d['dt'] \
+            - (1/d['battery_efficiency_discharge'])*m.B_OUT[t]*d['dt']
+    for t in first:
+        m.battery_soc[t].deactivate()
+    m.day_soc = Constraint(range(len(first)), rule=day_soc)
+
+
+    # Period costs (variables indexed by T, or by (K, T)) weighted by the days they represent
+    repn = generate_standard_repn(m.total_cost.expr, compute_values=True, quadratic=False)
+    coefs = []
+    for v, c in zip(repn.linear_vars, repn.linear_coefs):
+        var = v.parent_component()
+        if var.is_indexed() and list(var.index_set().subsets())[-1] is m.T:
+            c *= weight[v.index()[-1] if isinstance(v.index(), tuple) else v.index()]
+        coefs.append(c)
+    m.del_component(m.total_cost)
+    m.total_cost = Objective(expr=LinearExpression(constant=repn.constant, linear_coefs=coefs,
+                                                   linear_vars=list(repn.linear_vars)), sense=minimize)
+
+    return model_instance
+
+
+
+def compare_aggregation(data, k, solver, periods_per_day=PERIODS_PER_DAY, builder='rules', seed=0, representation='mean'):
+
+
+    model_data = microgrid_data_input(data)
+
+    # Both solves on the complete days only
+    n = (len(model_data[None]['T'])//periods_per_day)*periods_per_day
+    full = dict(model_data[None])
+    full['T'] = full['T'][:n]
+    for name, x in model_data[None].items():
+        if name != 'T' and np.ndim(x) == 1 and len(x) == len(model_data[None]['T']):
+            full[name] = np.asarray(x)[:n]
+    full = {None: full}
+
+    t = time.perf_counter()
+    agg = representative_days(full, k, periods_per_day, seed, representation)
+    reduced = aggregated_model(agg, builder)
+    solve_model(reduced, solver, tee=False)
+    time_aggregated = time.perf_counter() - t
+
+    t = time.perf_counter()
+    model_instance = microgrid_model(full, builder=builder)
+    solve_model(model_instance, solver, tee=False)
+    time_full = time.perf_counter() - t
+
+    r = {'k': k, 'days': agg['days'].tolist(), 'weights': agg['weights'].tolist(),
+         'rows_aggregated': n_constraints(reduced), 'rows_full': n_constraints(model_instance),
+         'time_aggregated': time_aggregated, 'time_full': time_full,
+         'profile_error': agg['profile_error']}
+
+    r['objective_aggregated'] = value(reduced.total_cost)
+    r['objective_full'] = value(model_instance.total_cost)
+    r['error'] = r['objective_aggregated'] - r['objective_full']
+    r['relative_error'] = r['error']/abs(r['objective_full']) if r['objective_full'] != 0 else np.nan
+
+    r['power_contract_aggregated'] = microgrid_results(reduced)['power_contract']
+    r['power_contract_full'] = microgrid_results(model_instance)['power_contract']
+
+    return r
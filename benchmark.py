@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+
+# Benchmark suite for the model build, LP write, solve and results extraction phases.
+#
+# Synthetic horizons from 1 day to 1 year at 15-minute resolution are made by
+# cycling the days of input.csv. Every case runs in a fresh worker process so
+# that the peak RSS belongs to that case alone. One JSON line per case is
+# appended to the output file.
+#
+#   build    microgrid_model / netmetering_model
+#   write    LP file writing on its own (file-based solvers repeat it inside solve),
+#            including the Pyomo rows of the matrix builder
+#   solve    solve_model, including the solver's own write/read/load
+#   extract  microgrid_results / netmetering_model_results
+#
+# --degradation adds the battery cycle aging cost of DEGRADATION to every case,
+# --degradation-overhead runs every case without and with it and reports the
+# extra build and solve time against the 20% budget.
+#
+# Example
+# python benchmark.py --days 1 7 30 90 365 --models microgrid netmetering --solver appsi_highs
+# python benchmark.py --days 365 --degradation
+# python benchmark.py --days 365 --degradation-overhead --builder matrix
+
+
+PERIODS_PER_DAY = 96
+
+# Cycle aging cost of --degradation: throughput cost and two steeper discharge segments
+DEGRADATION = {'battery_degradation_cost': 0.02, 'battery_degradation_segments': [(20, 0.02), (35, 0.05)]}
+INPUT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input.csv')
+
+
+
+def synthetic_input(days, path=INPUT_CSV, start='2021-01-01'):
+
+    # Cycle the complete days of the input file up to the requested horizon
+    df = pd.read_csv(path, header=0, sep=',', index_col=[0])
+    n_days = len(df)//PERIODS_PER_DAY
+    load = df['load_power_kW'].to_numpy()[:n_days*PERIODS_PER_DAY]
+    pv = df['pv_power_kW'].to_numpy()[:n_days*PERIODS_PER_DAY]
+
+    n = days*PERIODS_PER_DAY
+    index = pd.date_range(start, periods=n, freq='15min')
+
+    return pd.DataFrame({'load_power_kW': np.resize(load, n), 'pv_power_kW': np.resize(pv, n)}, index=index)
+
+
+def case_data(model, df):
+
+    n = len(df)
+    data = {'generation': df['pv_power_kW'],
+            'demand': df['load_power_kW'],
+            'battery_min_level': 0.1,
+            'battery_capacity': 100,
+            'battery_charge_max': 50,
+            'battery_discharge_max': 50,
+            'battery_efficiency_charge': 0.9,
+            'battery_efficiency_discharge': 0.9,
+            'bel_ini_level': 0.5,
+            'bel_fin_level': 0.5,
+            'energy_price_buy': np.full(n, 0.240382),
+            'energy_price_sell': np.full(n, 0.141895),
+            'dt': 0.25}
+
+    if model == 'microgrid':
+        data.update({'grid_fee_energy': 0.05, 'grid_fee_power': 10, 'grid_overcharge_penalty': 20,
+                     'grid_power_contract': 0})
+    else:
+        # Power fee in high-load hours (weekdays 7-19), as in Swedish tariffs
+        data.update({'grid_fixed_fee': 100,
+                     'grid_energy_import_fee': 0.05,
+                     'grid_energy_export_fee': 0.0,
+                     'grid_power_import_fee': {'value': 6.0, 'hours': range(7, 19), 'weekdays': range(5)},
+                     'grid_power_export_fee': 0.0,
+                     'month_order': df.index.month.to_numpy(),
+                     'timestamps': df.index})
+
+    return data
+
+
+
+def run_case(model, days, solver, builder='rules', degradation=False):
+
+
+    from pyomo.environ import value
+    from matrix_model import lp_constraints, n_constraints
+
+    if model == 'microgrid':
+        from model import microgrid_model as build, microgrid_data_input as data_input
+        from model import solve_model, microgrid_results as results
+    else:
+        from swedish_tariff_model import netmetering_model as build, netmetering_model_input as data_input
+        from swedish_tariff_model import solve_model, netmetering_model_results as results
+
+    r = {'model': model, 'builder': builder, 'solver': solver['name'], 'days': days, 'degradation': degradation}
+    data = case_data(model, synthetic_input(days))
+    if degradation:
+        data.update(DEGRADATION)
+    model_data = data_input(data)
+    r['periods'] = len(model_data[None]['T'])
+
+    t = time.perf_counter()
+    model_instance = build(model_data, builder=builder)
+    r['build_s'] = time.perf_counter() - t
+
+    r['rows'] = n_constraints(model_instance)
+    r['cols'] = model_instance.nvariables()
+
+    # The LP file needs the Pyomo rows, which the matrix builder only adds when needed
+    with tempfile.TemporaryDirectory() as tmp:
+        t = time.perf_counter()
+        lp_constraints(model_instance)
+        model_instance.write(os.path.join(tmp, 'model.lp'))
+        r['write_s'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    solve_model(model_instance, solver)
+    r['solve_s'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    results(model_instance)
+    r['extract_s'] = time.perf_counter() - t
+
+    r['objective'] = value(model_instance.total_cost)
+
+    # ru_maxrss is in kB on Linux; solver subprocesses are counted as children
+    r['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+    r['peak_rss_children_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024
+
+    return r
+
+
+
+def run_benchmarks(days, models, solver, builder='rules', output=None, degradation=False):
+
+    records = []
+    for model in models:
+        for d in days:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                r = pool.submit(run_case, model, d, solver, builder, degradation).result()
+            records.append(r)
+            print('%-12s %4d days  build %7.2fs  write %7.2fs  solve %7.2fs  extract %6.2fs  peak %7.1f MB'
+                  % (model, d, r['build_s'], r['write_s'], r['solve_s'], r['extract_s'], r['peak_rss_mb']),
+                  file=sys.stderr)
+            if output is not None:
+                with open(output, 'a') as f:
+                    f.write(json.dumps(r) + '\n')
+
+    return records
+
+
+
+def degradation_overhead(days, models, solver, builder='rules', output=None, budget=0.2):
+
+    # Extra build and solve time of the cycle aging cost: every case without and with DEGRADATION
+    off = run_benchmarks(days, models, solver, builder, output)
+    on = run_benchmarks(days, models, solver, builder, output, degradation=True)
+
+    overhead = []
+    for a, b in zip(off, on):
+        r = {'model': a['model'], 'days': a['days'], 'builder': builder,
+             'build': b['build_s']/a['build_s'] - 1, 'solve': b['solve_s']/a['solve_s'] - 1,
+             'total': (b['build_s'] + b['solve_s'])/(a['build_s'] + a['solve_s']) - 1}
+        overhead.append(r)
+        print('%-12s %4d days  degradation: build %+5.0f%%  solve %+5.0f%%  build+solve %+5.0f%%  %s'
+              % (r['model'], r['days'], 100*r['build'], 100*r['solve'], 100*r['total'],
+                 'ok' if r['total'] <= budget else 'over the %.0f%% budget' % (100*budget)), file=sys.stderr)
+
+    return overhead
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark model build, write, solve and extraction phases')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 7, 30, 90, 365])
+    parser.add_argument('--models', nargs='+', default=['microgrid', 'netmetering'], choices=['microgrid', 'netmetering'])
+    parser.add_argument('--solver', default='highs')
+    parser.add_argument('--solver-path', default=None)
+    parser.add_argument('--builder', default='rules', choices=['rules', 'matrix'])
+    parser.add_argument('--output', default='benchmark_results.jsonl')
+    parser.add_argument('--degradation', action='store_true', help='add the battery cycle aging cost')
+    parser.add_argument('--degradation-overhead', action='store_true',
+                        help='run every case without and with the cycle aging cost and compare build and solve times')
+    args = parser.parse_args()
+
+    solver = {'name': args.solver}
+    if args.solver_path:
+        solver['path'] = args.solver_path
+
+    if args.degradation_overhead:
+        degradation_overhead(args.days, args.models, solver, args.builder, args.output)
+    else:
+        run_benchmarks(args.days, args.models, solver, args.builder, args.output, args.degradation)
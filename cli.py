@@ -0,0 +1,365 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+
+# Headless command line entry point, for servers, cron and worker processes.
+#
+# Only the standard library is imported at start-up; NumPy, Pyomo and the
+# model modules are imported by the command that needs them, pandas only to
+# read CSV input, and matplotlib never (test.py keeps the plots).
+#
+#   solve    one site: per-period results to --output (CSV), summary KPIs to stdout
+#            as JSON. The site file is JSON (or YAML, with PyYAML) in the fleet job
+#            format (fleet.py):
+#            {"columns": {"generation": "pv_power_kW", "demand": "load_power_kW"},
+#             "params": {"battery_capacity": 100, ...}}
+#   run      many input files in windows of --horizon periods (default: the whole
+#            file), every window for every scenario of the configuration, --jobs
+#            solves at a time. Windows are read one by one and solved on their own,
+#            with the battery levels of the configuration. Per-period results and one
+#            summary row per solve are appended to periods.csv / summary.csv (or
+#            .parquet, one row group per solve) in --output-dir as each solve finishes.
+#            The configuration is the site file of solve, in JSON or YAML, plus
+#              "scenarios": {"battery_capacity": [50, 100]}  (grid, or list of dicts)
+#            An override that is not a number where the model expects one stops
+#            the run before any solve, with the scenario and key in the message.
+#              "horizon": 2976                              (periods per window)
+#   imports  import time of every entry module, each in a fresh interpreter,
+#            against IMPORT_BUDGET [s]; exits with 1 when a budget is exceeded or
+#            a heavy module (HEAVY_MODULES) is loaded by the import
+#
+# Example
+# python cli.py solve --input input.csv --site site.json --model microgrid --output results.csv
+# python cli.py run --input site-*.csv --config site.yaml --tariff swedish --jobs 8 --output-dir out --format parquet
+# python cli.py imports
+
+
+
+# Entry modules -> import time budget [s], measured on a single core
+IMPORT_BUDGET = {'cli': 0.1, 'model': 0.5, 'swedish_tariff_model': 0.5}
+
+# Modules that the entry modules must load only when used
+HEAVY_MODULES = ['pyomo.environ', 'pandas', 'matplotlib', 'scipy', 'highspy']
+
+# Tariff of the run command -> model
+TARIFFS = {'contract': 'microgrid', 'swedish': 'netmetering'}
+
+# Summary KPIs of every model
+SUMMARY = {'microgrid': ['energy_cost', 'grid_fee', 'degradation_cost', 'total_cost', 'grid_energy_bought', 'grid_energy_sold', 'power_contract'],
+           'netmetering': ['total_cost', 'grid_energy_bought', 'grid_energy_sold']}
+
+
+
+def read_config(path):
+
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Reading %s requires PyYAML, or give the configuration as JSON" % path)
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _optimizer(kind):
+
+    if kind == 'microgrid':
+        from model import microgrid_data_input, microgrid_optimize
+        return microgrid_data_input, microgrid_optimize
+    from swedish_tariff_model import netmetering_model_input, netmetering_optimize
+    return netmetering_model_input, netmetering_optimize
+
+
+def summary(kind, s):
+
+    # Scalar KPIs of a results dict of microgrid_optimize / netmetering_optimize
+    if kind == 'microgrid':
+        from model import microgrid_results_analysis
+        r = microgrid_results_analysis(s)
+        r['power_contract'] = s['power_contract']
+        return r
+
+    return {'total_cost': s['cost_total'], 'grid_energy_bought': sum(s['power_buy']),
+            'grid_energy_sold': sum(s['power_sell'])}
+
+
+def write_periods(path, s):
+
+    # Every per-period series of the results dict as one CSV column
+    import csv
+
+    n = len(s['power_buy'])
+    names = [k for k, v in s.items() if isinstance(v, list) and len(v) == n]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['period'] + names)
+        writer.writerows([t + 1] + [s[k][t] for k in names] for t in range(n))
+
+
+def solve(args):
+
+    from fleet import job_data
+    from solver_backend import default_solver
+
+    data = job_data(dict(read_config(args.site), input=args.input))
+    data_input, optimize = _optimizer(args.model)
+
+    solver = {'name': args.solver} if args.solver else default_solver()
+    s = optimize(data_input(data), solver, args.builder, tee=False)
+
+    if args.output:
+        write_periods(args.output, s)
+    print(json.dumps(summary(args.model, s)))
+
+    return 0
+
+
+
+class ChunkWriter:
+
+    # Appends chunks {column: values} to one CSV or Parquet file. The columns are fixed
+    # by the first chunk (or given), missing ones are written as NaN.
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.columns = columns
+        self.parquet = path.endswith('.parquet')
+        self.writer = None
+        self.file = None
+
+    def write(self, chunk):
+
+        if self.columns is None:
+            self.columns = list(chunk)
+        n = max(len(v) for v in chunk.values())
+        columns = [chunk.get(k, [float('nan')]*n) for k in self.columns]
+
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.table(dict(zip(self.columns, columns)))
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table.cast(self.writer.schema))
+            return
+
+        import csv
+        if self.file is None:
+            self.file = open(self.path, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.columns)
+        self.writer.writerows(zip(*columns))
+        self.file.flush()
+
+    def close(self):
+        if self.parquet and self.writer is not None:
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+def scenario_list(scenarios):
+
+    # Grid {name: [values]} -> all combinations, list of dicts as given, None -> the configuration alone
+    from itertools import product
+
+    if not scenarios:
+        return [dict()]
+    if isinstance(scenarios, dict):
+        names = list(scenarios)
+        return [dict(zip(names, values)) for values in product(*(scenarios[k] for k in names))]
+    return list(scenarios)
+
+
+def scenario_overrides(scenarios, params):
+
+    # Overrides parsed by the type of the parameter they replace: strings stay strings only
+    # where the configuration has a string, other strings must be numbers (e.g. "100" in YAML);
+    # lists and dicts (segments, schedules) are passed as they are
+    parsed = []
+    for j, overrides in enumerate(scenarios):
+        o = dict()
+        for k, v in overrides.items():
+            if isinstance(v, str) and not isinstance(params.get(k), str):
+                try:
+                    v = float(v)
+                except ValueError:
+                    raise ValueError("scenario %d: override '%s' = %r is not a number" % (j, k, v))
+            o[k] = v
+        parsed.append(o)
+
+    return parsed
+
+
+def summary_value(v):
+    # Override as a summary column: numbers as floats, strings as they are, others as JSON
+    if isinstance(v, (bool, int, float)):
+        return float(v)
+    return v if isinstance(v, str) else json.dumps(v)
+
+
+def run_tasks(args, config, scenarios):
+
+    # One task per input window and scenario, read only when the pool takes it
+    from data_io import iter_timeseries, timeseries_data
+    from solver_backend import default_solver
+
+    solver = {'name': args.solver} if args.solver else default_solver()
+    for path in args.input:
+        start = 0
+        for w, window in enumerate(iter_timeseries(path, args.horizon or config.get('horizon'))):
+            data = timeseries_data(window, config['columns'], **config.get('params', dict()))
+            if 'timestamps' in data and 'month_order' not in data:
+                import pandas as pd
+                data['month_order'] = pd.DatetimeIndex(data['timestamps']).month.to_numpy()
+            for j, overrides in enumerate(scenarios):
+                yield {'site': os.path.basename(path), 'window': w, 'start': start, 'scenario': j,
+                       'model': TARIFFS[args.tariff], 'data': data, 'overrides': overrides,
+                       'solver': solver, 'builder': args.builder}
+            start += len(data['generation'])
+
+
+def run_task(task):
+
+    # Runs in the worker process
+    data_input, optimize = _optimizer(task['model'])
+    s = optimize(data_input(dict(task['data'], **task['overrides'])), task['solver'], task['builder'], tee=False)
+
+    return summary(task['model'], s), s
+
+
+def run(args):
+
+
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    config = read_config(args.config)
+    try:
+        scenarios = scenario_overrides(scenario_list(config.get('scenarios')), config.get('params', dict()))
+    except ValueError as e:
+        args.error('%s: %s' % (args.config, e))
+    names = sorted({k for o in scenarios for k in o})
+    kind = TARIFFS[args.tariff]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    periods = ChunkWriter(os.path.join(args.output_dir, 'periods.' + args.format))
+    summaries = ChunkWriter(os.path.join(args.output_dir, 'summary.' + args.format),
+                            ['site', 'window', 'start', 'scenario'] + names + SUMMARY[kind] + ['status'])
+    failed = 0
+
+    def write(future, task):
+        nonlocal failed
+        key = {k: task[k] for k in ('site', 'window', 'start', 'scenario')}
+        record = dict(key, **{k: summary_value(v) for k, v in task['overrides'].items()})
+        try:
+            kpis, s = future.result()
+            record.update({k: float(v) for k, v in kpis.items()}, status='ok')
+        except Exception as e:
+            record['status'] = 'failed: %s' % e
+            failed += 1
+        summaries.write({k: [v] for k, v in record.items()})
+        print('%s window %d scenario %d: %s' % (task['site'], task['window'], task['scenario'], record['status']),
+              file=sys.stderr)
+
+        if record['status'] == 'ok':
+            n = len(s['power_buy'])
+            chunk = {k: [v]*n for k, v in key.items() if k != 'start'}
+            chunk['period'] = list(range(task['start'] + 1, task['start'] + n + 1))
+            if 'timestamps' in task['data']:
+                chunk['timestamp'] = [str(t) for t in task['data']['timestamps']]
+            chunk.update({k: v for k, v in s.items() if isinstance(v, list) and len(v) == n})
+            periods.write(chunk)
+
+
+    # At most 2 x jobs tasks in flight, so that the inputs are not all held in memory
+    with periods, summaries, ProcessPoolExecutor(args.jobs) as pool:
+        pending = dict()
+        for task in run_tasks(args, config, scenarios):
+            if len(pending) >= 2*args.jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future, pending.pop(future))
+            pending[pool.submit(run_task, task)] = task
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(future, pending.pop(future))
+
+    return int(failed > 0)
+
+
+
+def import_time(module):
+
+    # Seconds to import module in a fresh interpreter, and the heavy modules it loaded
+    code = ('import sys, time, json; t = time.perf_counter(); import %s; t = time.perf_counter() - t; '
+            'print(json.dumps([t, [m for m in %r if m in sys.modules]]))' % (module, HEAVY_MODULES))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    return json.loads(out.stdout)
+
+
+def imports(args):
+
+    status = 0
+    for module, budget in IMPORT_BUDGET.items():
+        t, heavy = min((import_time(module) for i in range(args.repeat)), key=lambda r: r[0])
+        ok = t <= budget*args.scale and not heavy
+        status = status or int(not ok)
+        print('%-22s %6.3fs  budget %6.3fs  %s%s' % (module, t, budget*args.scale, 'ok' if ok else 'OVER',
+                                                  '  loads %s' % ', '.join(heavy) if heavy else ''))
+
+    return status
+
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Microgrid optimization without plots')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('solve', help='optimize one site')
+    p.add_argument('--input', required=True, help='time series (.csv, .parquet, .feather, .npz)')
+    p.add_argument('--site', required=True, help='JSON or YAML file with the column mapping and the parameters')
+    p.add_argument('--model', default='microgrid', choices=['microgrid', 'netmetering'])
+    p.add_argument('--solver', default=None, help='solver name, default from MICROGRID_SOLVER_CONFIG')
+    p.add_argument('--builder', default='rules', choices=['rules', 'matrix'])
+    p.add_argument('--output', default=None, help='per-period results CSV')
+    p.set_defaults(run=solve)
+
+    p = commands.add_parser('run', help='optimize input files window by window and scenario by scenario')
+    p.add_argument('--input', required=True, nargs='+', help='time series files (.csv, .parquet, .feather, .npz)')
+    p.add_argument('--config', required=True, help='JSON or YAML site configuration')
+    p.add_argument('--tariff', default='contract', choices=list(TARIFFS))
+    p.add_argument('--jobs', type=int, default=1, help='solves at a time')
+    p.add_argument('--horizon', type=int, default=None, help='periods per window, default from the configuration')
+    p.add_argument('--solver', default=None, help='solver name, default from MICROGRID_SOLVER_CONFIG')
+    p.add_argument('--builder', default='rules', choices=['rules', 'matrix'])
+    p.add_argument('--output-dir', required=True)
+    p.add_argument('--format', default='csv', choices=['csv', 'parquet'])
+    p.set_defaults(run=run, error=p.error)
+
+    p = commands.add_parser('imports', help='check the import time budget')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--scale', type=float, default=1.0, help='budget multiplier for slower machines')
+    p.set_defaults(run=imports)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import os
+import numpy as np
+
+
+
+# Columnar time-series input.
+#
+# microgrid_data_input / netmetering_model_input keep every time series as one
+# contiguous float64 NumPy array instead of a {period: value} dict. All series
+# of a model are validated together in series_block (one value per period,
+# scalars broadcast, no NaN or infinite values). The matrix builder uses the
+# arrays as they are; the rule builder turns them into Param initializers with
+# indexed().
+#
+# Readers return a dict of column name -> array:
+#   .csv               pandas
+#   .parquet/.feather  pyarrow (optional dependency)
+#   .npy               memory-mapped single array (1-d, or 2-d with `columns` names)
+#   .npz               one array per column
+# iter_timeseries reads the same files in windows of a given number of periods.
+#
+# Fees can also be given as compact schedules instead of one value per period,
+# e.g. a power fee in weekday high-load hours (see schedule_series):
+#   data['grid_power_import_fee'] = {'value': 6.0, 'hours': range(7, 19), 'weekdays': range(5)}
+#   data['timestamps'] = df.index
+#
+# Example
+# columns = read_timeseries('input.csv')
+# data = timeseries_data(columns, {'generation': 'pv_power_kW', 'demand': 'load_power_kW'},
+#                        energy_price_buy=0.240382, energy_price_sell=0.141895, dt=0.25, ...)
+# model_data = microgrid_data_input(data)
+
+
+
+def series_block(data, n, defaults):
+
+    # All time series of a model at once: defaults is {name: default value}, None = required.
+    # The series are rows of one (len(defaults), n) float64 block, validated together.
+    # A series can also be a compact schedule (see schedule_series), expanded over data['timestamps'].
+    block = np.empty((len(defaults), n))
+    for i, (name, default) in enumerate(defaults.items()):
+        if name not in data and default is None:
+            raise KeyError("Missing model input '%s'" % name)
+        x = data.get(name, default)
+        if is_schedule(x):
+            x = schedule_series(x, data.get('timestamps'), name)
+        if hasattr(x, 'to_numpy'):
+            x = x.to_numpy()
+        if np.ndim(x) != 0 and np.shape(x) != (n,):
+            raise ValueError("'%s' must have one value for each of the %d periods, got shape %s" % (name, n, np.shape(x)))
+        block[i] = x
+
+    finite = np.isfinite(block).all(axis=1)
+    if not finite.all():
+        bad = [name for name, ok in zip(defaults, finite) if not ok]
+        raise ValueError("%s contain NaN or infinite values" % bad)
+
+    return dict(zip(defaults, block))
+
+
+def is_schedule(x):
+    return isinstance(x, dict) or (isinstance(x, (list, tuple)) and len(x) > 0 and isinstance(x[0], dict))
+
+
+def schedule_series(schedule, timestamps, name='schedule'):
+
+    # Compact schedule -> one value per timestamp. A schedule is one block or a list of blocks
+    #   {'value': 6.0, 'hours': range(7, 19), 'weekdays': range(5), 'months': [1, 2, 3, 11, 12]}
+    # hours 0-23, weekdays 0 = Monday, months 1-12; a missing key covers all of them.
+    # Later blocks override earlier ones, periods outside all blocks get 0.
+    if timestamps is None:
+        raise ValueError("'%s' is given as a schedule, add the period start times as data['timestamps']" % name)
+
+    import pandas as pd
+    index = pd.DatetimeIndex(timestamps)
+    fields = {'hours': index.hour, 'weekdays': index.dayofweek, 'months': index.month}
+
+    series = np.zeros(len(index))
+    for block in ([schedule] if isinstance(schedule, dict) else schedule):
+        unknown = set(block) - set(fields) - {'value'}
+        if unknown:
+            raise ValueError("Unknown keys %s in schedule '%s'" % (sorted(unknown), name))
+        mask = np.ones(len(index), dtype=bool)
+        for key, field in fields.items():
+            if key in block:
+                mask &= np.isin(field, list(block[key]))
+        series[mask] = block['value']
+
+    return series
+
+
+def indexed(x, periods):
+
+    # Param initializer over the periods; {period: value} dicts are passed through
+    if isinstance(x, dict):
+        return x
+    return dict(zip(np.asarray(periods).tolist(), np.asarray(x).tolist()))
+
+
+
+def read_timeseries(path, columns=None, mmap=True):
+
+
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.csv':
+        import pandas as pd
+        df = pd.read_csv(path, header=0, sep=',', index_col=[0])
+        return {k: df[k].to_numpy() for k in (columns or df.columns)}
+
+    if ext in ('.parquet', '.feather', '.arrow'):
+        try:
+            import pyarrow.parquet as pq
+            import pyarrow.feather as pf
+        except ImportError:
+            raise ImportError("Reading %s files requires pyarrow" % ext)
+        if ext == '.parquet':
+            table = pq.read_table(path, columns=columns)
+        else:
+            table = pf.read_table(path, columns=columns, memory_map=mmap)
+        return {k: table.column(k).to_numpy() for k in table.column_names}
+
+    if ext == '.npy':
+        array = np.load(path, mmap_mode='r' if mmap else None)
+        if array.ndim == 1:
+            return {(columns or ['values'])[0]: array}
+        if columns is None or len(columns) != array.shape[1]:
+            raise ValueError("A 2-d .npy file needs one name per column")
+        return {k: array[:, i] for i, k in enumerate(columns)}
+
+    if ext == '.npz':
+        with np.load(path) as stored:
+            return {k: stored[k] for k in (columns or stored.files)}
+
+    raise ValueError("Unsupported time-series file type '%s'" % ext)
+
+
+def iter_timeseries(path, periods=None, columns=None):
+
+    # Consecutive windows of `periods` rows (the last one may be shorter) as dicts of
+    # column name -> array. CSV and Parquet files are read window by window, the index
+    # column of a CSV file is included under its name. periods=None is one window.
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.csv':
+        import pandas as pd
+        chunks = pd.read_csv(path, header=0, sep=',', index_col=[0], chunksize=periods)
+        for df in ([chunks] if periods is None else chunks):
+            window = {df.index.name or 'index': df.index.to_numpy()}
+            window.update({k: df[k].to_numpy() for k in (columns or df.columns)})
+            yield window
+        return
+
+    if ext == '.parquet' and periods is not None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading %s files requires pyarrow" % ext)
+        pending = []
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=periods, columns=columns):
+            pending.append(batch)
+            table = pa.Table.from_batches(pending)
+            while table.num_rows >= periods:
+                yield {k: table.column(k).slice(0, periods).to_numpy() for k in table.column_names}
+                table = table.slice(periods)
+            pending = table.to_batches()
+        if pending and sum(b.num_rows for b in pending):
+            table = pa.Table.from_batches(pending)
+            yield {k: table.column(k).to_numpy() for k in table.column_names}
+        return
+
+    # Memory-mapped or small files: sliced after reading
+    data = read_timeseries(path, columns)
+    n = len(next(iter(data.values())))
+    for start in range(0, n, periods or max(n, 1)):
+        yield {k: v[start:start + (periods or n)] for k, v in data.items()}
+
+
+
+def timeseries_data(columns, mapping, **scalars):
+
+    # Build the data dict for microgrid_data_input / netmetering_model_input from
+    # columns (dict of arrays or DataFrame); mapping is {model input: column name}
+    data = {key: columns[name] for key, name in mapping.items()}
+    data.update(scalars)
+
+    return data
@@ -1,10 +1,9 @@
 import pandas as pd
 import numpy as np
 import numpy_financial as npf
-from datetime import datetime
 
 
-def financial_kpis(invest_cost, savings, discount_rate, project_lifespan):
+def financial_kpis(invest_cost, savings, discount_rate, project_lifespan, start_year=0):
     
     # This function returns: 
     # Cash flow table    
@@ -12,6 +11,8 @@ def financial_kpis(invest_cost, savings, discount_rate, project_lifespan):
     # Payback time [year]
     # Internal rate of return (IRR) [%]
     # Total / annual return of investment (ROI) [%]
+    # The cash flow table years are numbered from start_year+1, e.g. start_year=2024 for 2025, 2026, ...
+    # For many projects at once use financial_kpis_batch
     
     # Example
     # discount_rate = 0.08
@@ -21,7 +22,7 @@ def financial_kpis(invest_cost, savings, discount_rate, project_lifespan):
     # cf, npv, payback_time, irr, roi_total, roi_annual = kpis(invest_cost, savings, discount_rate, project_lifespan)
     
     # Create cash flow table
-    cf = cash_flow_table(invest_cost, savings, discount_rate, project_lifespan)
+    cf = cash_flow_table(invest_cost, savings, discount_rate, project_lifespan, start_year)
 
     # Net present value (NPV)
     npv = cf['Net Present Value'].iloc[-1]
@@ -59,26 +60,118 @@ def financial_kpis(invest_cost, savings, discount_rate, project_lifespan):
     return cf, npv, payback_time, irr, roi_total, roi_annual
 
 
-def cash_flow_table(invest_cost, savings, discount_rate, project_lifespan):
+def cash_flow_table(invest_cost, savings, discount_rate, project_lifespan, start_year=0):
 
-    data = []
-    cashflow_accumulated = 0
-    year = datetime.now().year
-    for i in range(1,project_lifespan+1):
-        
-        year = year + 1
-        
-        cashflow = savings
-        
-        cashflow_discounted = savings/((1+discount_rate)**i)
-        
-        cashflow_accumulated = cashflow_accumulated + cashflow_discounted
-        
-        net_present_value = cashflow_accumulated - invest_cost
-        
-        data.append([year, cashflow, cashflow_discounted, cashflow_accumulated, net_present_value])
-        
-    
-    cf = pd.DataFrame(data, columns=['Year', 'Annual Savings', 'Annual Savings Discounted', 'Accumulated Discounted Savings', 'Net Present Value'])
+    # Year column runs from start_year+1 to start_year+project_lifespan
+    years = np.arange(1, project_lifespan+1)
+
+    cashflow = np.full(project_lifespan, savings, dtype=float)
+    cashflow_discounted = savings/((1+discount_rate)**years)
+    cashflow_accumulated = np.cumsum(cashflow_discounted)
+    net_present_value = cashflow_accumulated - invest_cost
+
+    cf = pd.DataFrame({'Year': start_year + years,
+                       'Annual Savings': cashflow,
+                       'Annual Savings Discounted': cashflow_discounted,
+                       'Accumulated Discounted Savings': cashflow_accumulated,
+                       'Net Present Value': net_present_value})
+
+    return cf
+
+
+
+def financial_kpis_batch(invest_cost, savings, discount_rate, project_lifespan):
+
+    # Vectorized financial_kpis for arrays of projects; all inputs broadcast against each other.
+    # Returns a dict of arrays: npv, payback_time, irr, roi_total, roi_annual
+    # payback_time is numeric: below 1 where financial_kpis says 'Less than a year'
+    # (interpolated from -invest_cost at year 0) and inf where it says 'More than ... years'.
+    # roi_annual is NaN where financial_kpis would return a complex number.
+
+    invest_cost, savings, discount_rate, project_lifespan = np.broadcast_arrays(
+        np.asarray(invest_cost, dtype=float), np.asarray(savings, dtype=float),
+        np.asarray(discount_rate, dtype=float), np.asarray(project_lifespan, dtype=int))
+
+    years = np.arange(1, project_lifespan.max(initial=1)+1)
+    active = years <= project_lifespan[..., None]
+
+
+    # Net present value over the years, with -invest_cost in year 0
+    discounted = np.where(active, savings[..., None]/((1+discount_rate[..., None])**years), 0.0)
+    npv_years = np.concatenate((-invest_cost[..., None], np.cumsum(discounted, axis=-1) - invest_cost[..., None]), axis=-1)
+    npv = np.take_along_axis(npv_years, project_lifespan[..., None], axis=-1)[..., 0]
+
+
+    # Payback time: linear interpolation in the first year the NPV turns positive
+    positive = (npv_years[..., 1:] > 0) & active
+    k = positive.argmax(axis=-1)
+    before = np.take_along_axis(npv_years, k[..., None], axis=-1)[..., 0]
+    after = np.take_along_axis(npv_years, k[..., None]+1, axis=-1)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        payback_time = np.where(positive.any(axis=-1), k - before/(after - before), np.inf)
+
+
+    # Internal rate of return of [-invest_cost, savings, ..., savings]
+    cashflows = np.concatenate((-invest_cost[..., None], np.where(active, savings[..., None], 0.0)), axis=-1)
+    irr = np.round(irr_batch(cashflows), 3)*100
+
+
+    # Return of investment
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roi_total = np.where(invest_cost != 0, (savings*project_lifespan - invest_cost)/invest_cost, np.nan)
+        roi_annual = (1+roi_total)**(1/project_lifespan) - 1
+
+    return {'npv': npv, 'payback_time': payback_time, 'irr': irr,
+            'roi_total': roi_total*100, 'roi_annual': roi_annual*100}
+
+
+
+def irr_batch(cashflows, low=-1.0, high=1e6, tol=1e-12, max_iter=100):
+
+    # IRR of every row of cashflows (year 0 first, last axis) by Newton steps safeguarded
+    # with bisection on [low, high]. NPV must change sign on the bracket, else NaN.
+    # For conventional cash flows (one sign change) the IRR is unique.
+    # Below r = 0 the NPV is taken times (1+r)**n (n the last year with a cash flow): same
+    # sign and root, but finite down to r = -1, so that IRRs below -99% are found as by npf.irr
+
+    cashflows = np.asarray(cashflows, dtype=float)
+    t = np.arange(cashflows.shape[-1])
+    last = cashflows.shape[-1] - 1 - np.argmax(cashflows[..., ::-1] != 0, axis=-1)
+    used = t <= last[..., None]
+
+    def npv(r):
+        x = 1 + r[..., None]
+        k = np.where(r[..., None] < 0, last[..., None] - t, -t)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            f = np.where(used, cashflows*x**k, 0.0).sum(axis=-1)
+            df = np.where(used & (k != 0), cashflows*k*x**(k-1), 0.0).sum(axis=-1)
+        return f, df
+
+    shape = cashflows.shape[:-1]
+    lo = np.full(shape, low)
+    hi = np.full(shape, high)
+    f_lo = npv(lo)[0]
+    f_hi = npv(hi)[0]
+    bracketed = np.sign(f_lo)*np.sign(f_hi) < 0
+
+    r = np.where(bracketed, 0.1, np.nan)
+    for i in range(max_iter):
+        f, df = npv(r)
+
+        # Keep the root inside [lo, hi]
+        left = np.sign(f) == np.sign(f_lo)
+        lo = np.where(left, r, lo)
+        hi = np.where(left, hi, r)
+        f_lo = np.where(left, f, f_lo)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = r - f/df
+        newton = np.isfinite(step) & (step > lo) & (step < hi)
+        r_next = np.where(newton, step, (lo+hi)/2)
+
+        done = ~bracketed | (np.abs(r_next - r) < tol)
+        r = np.where(bracketed, r_next, np.nan)
+        if done.all():
+            break
 
-    return cf
\ No newline at end of file
+    return r
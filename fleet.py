@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+
+
+# Fleet runner: many sites optimized concurrently with an asyncio job queue.
+#
+# A site job is a dict
+#   {'site': 'site-001', 'model': 'microgrid', 'data': data}
+# or, to read the time series in the worker instead of the caller,
+#   {'site': 'site-001', 'model': 'netmetering', 'input': 'site-001.csv',
+#    'columns': {'generation': 'pv_power_kW', 'demand': 'load_power_kW'}, 'params': {...}}
+# (see data_io.read_timeseries / timeseries_data). 'model' is 'microgrid' (default)
+# or 'netmetering'.
+#
+# max_workers worker slots take jobs from the queue; every slot owns one solver
+# process, so at most max_workers solves run at a time and the event loop never
+# blocks on a solve. A job running longer than timeout [s] has its process killed
+# and replaced; timed-out and crashed jobs are tried again up to retries times
+# (errors raised by the model itself, e.g. missing inputs, are not).
+#
+# Results are streamed as each job finishes: one summary record per site is
+# appended to the JSON lines file output, and the full results dict of every
+# solved site is written by its worker to results_dir/<site>.npz.
+#
+# Example
+# async for r in fleet_stream(jobs, solver, max_workers=8, timeout=600, output='fleet.jsonl'):
+#     print(r['site'], r['status'], r.get('total_cost'))
+# df = run_fleet(jobs, solver, max_workers=8, results_dir='fleet_results')
+
+
+DEFAULT_MODEL = 'microgrid'
+
+
+
+def _model(kind):
+
+    if kind == 'microgrid':
+        from model import microgrid_data_input, microgrid_model, microgrid_results
+        return microgrid_data_input, microgrid_model, microgrid_results
+    if kind == 'netmetering':
+        from swedish_tariff_model import netmetering_model_input, netmetering_model, netmetering_model_results
+        return netmetering_model_input, netmetering_model, netmetering_model_results
+
+    raise ValueError("Unknown model '%s', use 'microgrid' or 'netmetering'" % kind)
+
+
+def job_data(job):
+
+    if 'data' in job:
+        return job['data']
+
+    from data_io import read_timeseries, timeseries_data
+    return timeseries_data(read_timeseries(job['input']), job['columns'], **job.get('params', dict()))
+
+
+def solve_site(job, solver, results_dir=None):
+
+    # Runs in the worker process, returns the summary record of the site
+    from pyomo.core import value
+    from model_core import solve_model
+
+    data_input, build, results = _model(job.get('model', DEFAULT_MODEL))
+    model_instance = build(data_input(job_data(job)))
+    solve_model(model_instance, solver, tee=False)
+    s = results(model_instance)
+
+    if results_dir is not None:
+        f = os.path.join(results_dir, '%s.npz' % job['site'])
+        tmp = f + '.tmp.npz'
+        np.savez_compressed(tmp, **{k: np.asarray(v, dtype=np.float64) for k, v in s.items()})
+        os.replace(tmp, f)
+
+    return {'total_cost': float(value(model_instance.total_cost)),
+            'grid_energy_bought': float(sum(s['power_buy'])), 'grid_energy_sold': float(sum(s['power_sell']))}
+
+
+
+def _kill(pool):
+
+    # A hung solve cannot be cancelled, its process is killed
+    for process in list((pool._processes or dict()).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _worker(jobs, done, solver, timeout, retries, results_dir):
+
+
+    loop = asyncio.get_running_loop()
+    pool = ProcessPoolExecutor(max_workers=1)
+
+    try:
+        while True:
+            job = await jobs.get()
+            if job is None:
+                break
+
+            record = {'site': None}
+            t = time.perf_counter()
+            for attempt in range(1, retries + 2):
+                try:
+                    # A job without 'site' fails on its own instead of stopping the worker
+                    record.update(site=job['site'], model=job.get('model', DEFAULT_MODEL))
+                    summary = await asyncio.wait_for(loop.run_in_executor(pool, solve_site, job, solver, results_dir), timeout)
+                    record.update(summary, status='ok')
+                    break
+                except asyncio.TimeoutError:
+                    record['status'] = 'timeout after %gs' % timeout
+                    _kill(pool)
+                    pool = ProcessPoolExecutor(max_workers=1)
+                except BrokenProcessPool as e:
+                    record['status'] = 'failed: solver process died (%s)' % e
+                    pool.shutdown(wait=True)
+                    pool = ProcessPoolExecutor(max_workers=1)
+                except Exception as e:
+                    record['status'] = 'failed: %s' % (e.args[0] if isinstance(e, KeyError) and e.args else e)
+                    break
+
+            record['attempts'] = attempt
+            record['wall_s'] = time.perf_counter() - t
+            await done.put(record)
+    finally:
+        _kill(pool)
+
+
+async def _feed(jobs, queue, n_workers):
+
+    # jobs: iterable, async iterable or asyncio.Queue ended by None
+    if isinstance(jobs, asyncio.Queue):
+        while (job := await jobs.get()) is not None:
+            await queue.put(job)
+    elif hasattr(jobs, '__aiter__'):
+        async for job in jobs:
+            await queue.put(job)
+    else:
+        for job in jobs:
+            await queue.put(job)
+
+    for i in range(n_workers):
+        await queue.put(None)
+
+
+
+async def fleet_stream(jobs, solver, max_workers=None, timeout=None, retries=1, output=None, results_dir=None):
+
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if results_dir is not None:
+        os.makedirs(results_dir, exist_ok=True)
+
+    # Bounded queue: jobs are taken from the source only as fast as they are solved
+    queue = asyncio.Queue(maxsize=2*max_workers)
+    done = asyncio.Queue()
+
+    tasks = [asyncio.create_task(_worker(queue, done, solver, timeout, retries, results_dir))
+             for i in range(max_workers)]
+    feeder = asyncio.create_task(_feed(jobs, queue, max_workers))
+
+    # The end of the records is always queued: None, or the error of the job source or a
+    # worker, which is raised to the consumer
+    async def finish():
+        end = None
+        try:
+            await asyncio.gather(feeder, *tasks)
+        except Exception as e:
+            end = e
+        finally:
+            await done.put(end)
+    closer = asyncio.create_task(finish())
+
+    try:
+        while (record := await done.get()) is not None:
+            if isinstance(record, Exception):
+                raise record
+            if output is not None:
+                with open(output, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+            yield record
+        await closer
+    finally:
+        for task in [feeder, closer] + tasks:
+            task.cancel()
+
+
+
+def run_fleet(jobs, solver, max_workers=None, timeout=None, retries=1, output=None, results_dir=None, progress=None):
+
+    # Blocking wrapper of fleet_stream, returns one row per site in completion order
+    import pandas as pd
+
+    async def collect():
+        records = []
+        async for r in fleet_stream(jobs, solver, max_workers, timeout, retries, output, results_dir):
+            records.append(r)
+            if progress:
+                progress(len(records), r)
+        return records
+
+    return pd.DataFrame(asyncio.run(collect()))
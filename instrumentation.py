@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+import json
+import logging
+import time
+
+
+
+# Structured timing events for model building and solving.
+#
+# An event sink is any callable taking one dict. solve_model(..., events=sink)
+# emits one 'phase' event per solve phase and one 'solve' summary event:
+#   write   problem file writing (file-based solvers such as glpk/cbc)
+#   solve   solver run (for in-process solvers this includes loading the model)
+#   read    reading the solver output file
+#   load    loading the solution into the model
+# With audit=True an 'audit' event with the report of model_audit.audit_model comes first.
+# timed_phase() emits the same 'phase' events around any other block, e.g. the build.
+#
+# Example
+# events = []
+# with timed_phase('build', events.append):
+#     model_instance = microgrid_model(model_data)
+# solve_model(model_instance, solver, events=logging_sink())
+#
+# Summary event:
+# {'event': 'solve', 'solver': 'glpk', 'status': 'ok', 'termination_condition': 'optimal',
+#  'iterations': None, 'rows': 59995, 'cols': 69996, 'nonzeros': 199981,
+#  'wall_s': 3.1, 'cpu_s': 1.2, 'phases': {'write': 0.6, 'solve': 2.1, 'read': 0.3, 'load': 0.1}}
+
+
+
+def logging_sink(logger=None, level=logging.INFO):
+
+    # Events as one JSON line per log record
+    logger = logger or logging.getLogger('microgrid.solve')
+
+    def sink(event):
+        logger.log(level, json.dumps(event, default=str))
+
+    return sink
+
+
+@contextmanager
+def timed_phase(name, events, **fields):
+
+    # The yielded dict can be extended inside the block and is emitted at the end
+    event = {'event': 'phase', 'phase': name}
+    event.update(fields)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield event
+    finally:
+        event['wall_s'] = time.perf_counter() - wall
+        event['cpu_s'] = time.process_time() - cpu
+        if events is not None:
+            events(event)
+
+
+
+def model_size(model_instance, optimizer=None):
+
+    from pyomo.environ import Constraint
+    from pyomo.core.expr.visitor import identify_variables
+
+    size = {'rows': model_instance.nconstraints(), 'cols': model_instance.nvariables()}
+
+    # In-process HiGHS knows its matrix, otherwise count the variables of every active row
+    highs = getattr(optimizer, '_solver_model', None)
+    if highs is not None and hasattr(highs, 'getNumNz'):
+        size['nonzeros'] = highs.getNumNz()
+    else:
+        size['nonzeros'] = sum(sum(1 for v in identify_variables(con.body, include_fixed=False))
+                               for con in model_instance.component_data_objects(Constraint, active=True))
+
+    return size
+
+
+def _iterations(results, optimizer):
+
+    highs = getattr(optimizer, '_solver_model', None)
+    if highs is not None and hasattr(highs, 'getInfo'):
+        info = highs.getInfo()
+        return info.simplex_iteration_count + info.ipm_iteration_count
+
+    # File-based LP solvers do not report iteration counts to Pyomo
+    return None
+
+
+
+def instrumented_solve(optimizer, model_instance, events, solver_name, **kwds):
+
+
+    phases = dict()
+
+    def timed(name, method):
+        def wrapper(*args, **kw):
+            with timed_phase(name, events, solver=solver_name) as event:
+                out = method(*args, **kw)
+            phases[name] = event['wall_s']
+            return out
+        return wrapper
+
+    # File-based solvers (OptSolver) run write / solve / read as separate methods of the instance
+    file_based = all(hasattr(optimizer, m) for m in ('_presolve', '_apply_solver', '_postsolve'))
+    if file_based:
+        optimizer._presolve = timed('write', optimizer._presolve)
+        optimizer._apply_solver = timed('solve', optimizer._apply_solver)
+        optimizer._postsolve = timed('read', optimizer._postsolve)
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        results = optimizer.solve(model_instance, **kwds)
+    finally:
+        if file_based:
+            del optimizer._presolve, optimizer._apply_solver, optimizer._postsolve
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    # Loading happens inside solve() after the read; in-process solvers have a single phase
+    if file_based:
+        phases['load'] = max(wall - sum(phases.values()), 0.0)
+        events({'event': 'phase', 'phase': 'load', 'solver': solver_name, 'wall_s': phases['load'], 'cpu_s': None})
+    else:
+        phases['solve'] = wall
+        events({'event': 'phase', 'phase': 'solve', 'solver': solver_name, 'wall_s': wall, 'cpu_s': cpu})
+
+    event = {'event': 'solve', 'solver': solver_name,
+             'status': str(results.solver.status),
+             'termination_condition': str(results.solver.termination_condition),
+             'iterations': _iterations(results, optimizer)}
+    event.update(model_size(model_instance, optimizer))
+    event.update({'wall_s': wall, 'cpu_s': cpu, 'phases': phases})
+    events(event)
+
+    return results
@@ -0,0 +1,470 @@
+from pyomo.core import ConcreteModel
+from pyomo.core import Set,Var,Objective,Constraint
+from pyomo.core import minimize
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.common.collections import ComponentSet
+from itertools import product
+import numpy as np
+
+
+
+# Matrix-form builder for the models of model_core.py (builder='matrix').
+#
+# The LP is assembled straight from NumPy arrays into sparse rows
+#     row_lo <= A x <= row_up,   col_lo <= x <= col_up,   min c x + c0
+# with A stored in CSR form (indptr, indices, data). build_lp adds the shared
+# battery, energy-balance and grid-exchange rows and the tariff module adds
+# its own columns and rows with tariff_lp (see tariff_contract.py).
+# Variable and constraint families keep the names of the rule-based models,
+# so the Pyomo model returned by lp_to_pyomo works with solve_model and the
+# results functions.
+#
+# lp_to_pyomo only builds the sets, variables and objective and keeps the LP on
+# the model. In-process HiGHS (solver_backend.py) reads the CSR arrays as they
+# are (lp_arrays), so the rows never become Pyomo expressions. The constraint
+# families are added on first need with lp_constraints: for other solvers, for
+# the audit, for duals, or before changing rows or writing the model to a file.
+# Deactivated rows are passed as free rows; any other active constraint makes
+# solver_backend compile the model instead.
+#
+# stack_lp repeats an LP over scenarios (block-diagonal, scenario-major rows)
+# with some columns shared by all scenarios; the other families are then
+# indexed by ('S', index), see stochastic.py.
+
+
+
+def lp_series(model_data, key):
+    # Time series are passed either as {period: value} dicts or as arrays
+    x = model_data[None][key]
+    if isinstance(x, dict):
+        x = list(x.values())
+    return np.asarray(x, dtype=float)
+
+
+def _new_lp(layout, sets):
+
+    # layout: list of (variable name, index set name or None)
+    lp = {'sets': sets, 'columns': dict(), 'rows': dict(),
+          'n_cols': 0, 'n_rows': 0, '_r': [], '_c': [], '_v': [], '_lo': [], '_up': []}
+
+    for name, index in layout:
+        size = _size(sets, index)
+        lp['columns'][name] = (index, np.arange(lp['n_cols'], lp['n_cols']+size))
+        lp['n_cols'] += size
+
+    lp['c'] = np.zeros(lp['n_cols'])
+    lp['c0'] = 0.0
+    lp['col_lo'] = np.full(lp['n_cols'], -np.inf)
+    lp['col_up'] = np.full(lp['n_cols'], np.inf)
+    lp['fixed'] = np.zeros(lp['n_cols'], dtype=bool)
+
+    return lp
+
+
+def _size(sets, index):
+    # Number of elements of an index set, or of the product of a tuple of index sets
+    if index is None:
+        return 1
+    return int(np.prod([len(sets[i]) for i in (index if isinstance(index, tuple) else (index,))]))
+
+
+def lp_column(lp, name):
+    return lp['columns'][name][1]
+
+
+def add_rows(lp, name, index, terms, lo, up, where=None):
+
+    # Every term is a (columns, coefficients) pair with one entry per element of the index set.
+    # where: boolean mask over the index set, rows are only added where it is True
+    # (lp['rows'][name] then holds -1 for the skipped elements)
+    size = _size(lp['sets'], index)
+    where = np.ones(size, dtype=bool) if where is None else np.broadcast_to(where, (size,))
+    nrows = int(where.sum())
+    rows = np.full(size, -1, dtype=np.int64)
+    rows[where] = np.arange(lp['n_rows'], lp['n_rows']+nrows)
+
+    for cols, coefs in terms:
+        cols = np.broadcast_to(cols, (size,))[where]
+        coefs = np.broadcast_to(np.asarray(coefs, dtype=float), (size,))[where]
+        keep = coefs != 0
+        lp['_r'].append(rows[where][keep])
+        lp['_c'].append(cols[keep])
+        lp['_v'].append(coefs[keep])
+
+    lp['_lo'].append(np.broadcast_to(np.asarray(lo, dtype=float), (size,))[where])
+    lp['_up'].append(np.broadcast_to(np.asarray(up, dtype=float), (size,))[where])
+    lp['rows'][name] = (index, rows)
+    lp['n_rows'] += nrows
+
+
+def add_terms(lp, name, terms):
+
+    # More (columns, coefficients) terms on the existing rows of the family name
+    index, rows = lp['rows'][name]
+    where = rows >= 0
+
+    for cols, coefs in terms:
+        cols = np.broadcast_to(cols, rows.shape)[where]
+        coefs = np.broadcast_to(np.asarray(coefs, dtype=float), rows.shape)[where]
+        keep = coefs != 0
+        lp['_r'].append(rows[where][keep])
+        lp['_c'].append(cols[keep])
+        lp['_v'].append(coefs[keep])
+
+
+def _finalize(lp):
+
+    r = np.concatenate(lp.pop('_r'))
+    c = np.concatenate(lp.pop('_c'))
+    v = np.concatenate(lp.pop('_v'))
+    lp['row_lo'] = np.concatenate(lp.pop('_lo'))
+    lp['row_up'] = np.concatenate(lp.pop('_up'))
+
+    # Sort into CSR order and merge duplicate entries
+    key = r.astype(np.int64)*lp['n_cols'] + c
+    key, inverse = np.unique(key, return_inverse=True)
+    data = np.zeros(len(key))
+    np.add.at(data, inverse, v)
+
+    rows = key // lp['n_cols']
+    lp['indices'] = (key % lp['n_cols']).astype(np.int64)
+    lp['data'] = data
+    lp['indptr'] = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=lp['n_rows'])))).astype(np.int64)
+    lp['nnz'] = len(data)
+
+    return lp
+
+
+
+# Shared columns, the tariff module adds its own with COLUMNS
+CORE_COLUMNS = [('COST_ENERGY', 'T'), ('P_BUY', 'T'), ('P_SELL', 'T'), ('BEL', 'T'), ('B_IN', 'T'), ('B_OUT', 'T')]
+
+
+
+def build_lp(model_data, tariff, columns=(), extend=None):
+
+
+    d = model_data[None]
+    T = np.asarray(d['T'])
+    n = len(T)
+
+    generation = lp_series(model_data, 'generation')
+    demand = lp_series(model_data, 'demand')
+    energy_price_buy = lp_series(model_data, 'energy_price_buy')
+    energy_price_sell = lp_series(model_data, 'energy_price_sell')
+    dt = d['dt']
+
+
+    # Degradation segments below the discharge limit
+    segments = d['battery_degradation_segments']
+    segments = segments[segments[:, 0] < d['battery_discharge_max']]
+    degradation = [('B_OUT_EXCESS', ('K', 'T'))] if len(segments) else []
+
+    sets = {'T': T}
+    if len(segments):
+        sets['K'] = np.arange(1, len(segments)+1)
+    sets.update(tariff.tariff_sets(model_data))
+    lp = _new_lp(CORE_COLUMNS + degradation + tariff.COLUMNS + list(columns), sets)
+
+    CE = lp_column(lp, 'COST_ENERGY')
+    PB, PS = lp_column(lp, 'P_BUY'), lp_column(lp, 'P_SELL')
+    BEL, BIN, BOUT = lp_column(lp, 'BEL'), lp_column(lp, 'B_IN'), lp_column(lp, 'B_OUT')
+
+
+    ## VARIABLE LIMITS
+    lp['col_lo'][PB] = 0.0
+    lp['col_lo'][PS] = 0.0
+    lp['col_lo'][BEL] = max(0.0, d['battery_min_level']*d['battery_capacity'])
+    lp['col_up'][BEL] = d['battery_capacity']
+    lp['col_lo'][BIN], lp['col_up'][BIN] = 0.0, d['battery_charge_max']
+    lp['col_lo'][BOUT], lp['col_up'][BOUT] = 0.0, d['battery_discharge_max']
+
+
+    ## OBJECTIVE
+    lp['c'][CE] = 1.0
+    lp['c'][BOUT] = d['battery_degradation_cost']*dt
+
+
+    ## CONSTRAINTS
+    # Energy cost
+    add_rows(lp, 'energy_cost', 'T',
+             [(CE, 1.0), (PB, -energy_price_buy*dt), (PS, energy_price_sell*dt)], 0.0, 0.0)
+
+    # Energy balance
+    add_rows(lp, 'energy_balance', 'T',
+             [(PS, 1.0), (PB, -1.0), (BOUT, -1.0), (BIN, 1.0)], generation - demand, generation - demand)
+
+    # Battery charging from grid
+    if d['battery_grid_charging'] == False:
+        add_rows(lp, 'no_grid_charging', 'T', [(PB, 1.0)], -np.inf, demand)
+
+    # Battery energy balance
+    _battery_soc_rows(lp, d, n)
+
+    # Fix battery soc in the last period
+    if d['bel_fin_level'] > 0:
+        fix_column(lp, BEL[-1], d['bel_fin_level']*d['battery_capacity'])
+
+    # Battery degradation: discharge power above the first segment power, split into the
+    # segments up to the power of the next one; segment k costs the extra costs of segments 1..k
+    if len(segments):
+        EXCESS = lp_column(lp, 'B_OUT_EXCESS').reshape(len(segments), n)
+        lp['col_lo'][EXCESS] = 0.0
+        lp['col_up'][EXCESS] = np.append(np.diff(segments[:, 0]), np.inf)[:, None]
+        lp['c'][EXCESS] = np.cumsum(segments[:, 1])[:, None]*dt
+        add_rows(lp, 'discharge_excess', 'T', [(BOUT, 1.0)] + [(cols, -1.0) for cols in EXCESS], -np.inf, segments[0, 0])
+
+    # Tariff columns and rows
+    tariff.tariff_lp(lp, model_data)
+
+    # extend(lp, model_data): rows of the extra columns
+    if extend is not None:
+        extend(lp, model_data)
+
+    return _finalize(lp)
+
+
+def _battery_soc_rows(lp, d, n):
+
+    BEL, BIN, BOUT = lp_column(lp, 'BEL'), lp_column(lp, 'B_IN'), lp_column(lp, 'B_OUT')
+    dt = d['dt']
+
+    # BEL[t] - BEL[t-1] == eff_ch*B_IN[t]*dt - B_OUT[t]*dt/eff_dis, with BEL[0] = bel_ini_level*capacity
+    previous = np.concatenate((BEL[:1], BEL[:-1]))
+    previous_coef = np.full(n, -1.0)
+    previous_coef[0] = 0.0
+    rhs = np.zeros(n)
+    rhs[0] = d['bel_ini_level']*d['battery_capacity']
+
+    add_rows(lp, 'battery_soc', 'T',
+             [(BEL, 1.0), (previous, previous_coef),
+              (BIN, -d['battery_efficiency_charge']*dt), (BOUT, dt/d['battery_efficiency_discharge'])],
+             rhs, rhs)
+
+
+def fix_column(lp, col, val):
+    lp['col_lo'][col] = val
+    lp['col_up'][col] = val
+    lp['fixed'][col] = True
+
+
+
+def stack_lp(lp, weights, shared=()):
+
+
+    # One copy of lp per scenario, the objective of every copy weighted by its
+    # probability (weights sum to 1); the column families in shared are one set of
+    # columns used by all scenarios (first-stage decisions)
+    weights = np.asarray(weights, dtype=float)
+    n = len(weights)
+    stacked = {'sets': dict(lp['sets'], S=np.arange(n)), 'columns': dict(), 'rows': dict()}
+
+
+    # Column numbering family by family, scenario-major inside a family
+    col_map = np.empty((n, lp['n_cols']), dtype=np.int64)
+    c, col_lo, col_up, fixed = [], [], [], []
+    n_cols = 0
+    for name, (index, cols) in lp['columns'].items():
+        if name in shared:
+            col_map[:, cols] = n_cols + np.arange(len(cols))
+            stacked['columns'][name] = (index, n_cols + np.arange(len(cols)))
+            c.append(lp['c'][cols])
+            copies = 1
+        else:
+            col_map[:, cols] = n_cols + np.arange(n)[:, None]*len(cols) + np.arange(len(cols))
+            stacked['columns'][name] = (_scenario_index(index), n_cols + np.arange(n*len(cols)))
+            c.append(np.outer(weights, lp['c'][cols]).ravel())
+            copies = n
+        col_lo.append(np.tile(lp['col_lo'][cols], copies))
+        col_up.append(np.tile(lp['col_up'][cols], copies))
+        fixed.append(np.tile(lp['fixed'][cols], copies))
+        n_cols += copies*len(cols)
+
+    stacked.update(n_cols=n_cols, c=np.concatenate(c), c0=lp['c0'], col_lo=np.concatenate(col_lo),
+                   col_up=np.concatenate(col_up), fixed=np.concatenate(fixed))
+
+
+    # Rows scenario-major, skipped elements stay -1
+    offset = np.arange(n)[:, None]*lp['n_rows']
+    for name, (index, rows) in lp['rows'].items():
+        stacked['rows'][name] = (_scenario_index(index),
+                                 np.where(rows[None, :] < 0, -1, rows[None, :] + offset).ravel())
+
+    stacked['n_rows'] = n*lp['n_rows']
+    stacked['row_lo'] = np.tile(lp['row_lo'], n)
+    stacked['row_up'] = np.tile(lp['row_up'], n)
+
+    row_nnz = np.diff(lp['indptr'])
+    stacked['indptr'] = np.concatenate(([0], np.cumsum(np.tile(row_nnz, n)))).astype(np.int64)
+    stacked['indices'] = col_map[:, lp['indices']].ravel()
+    stacked['data'] = np.tile(lp['data'], n)
+    stacked['nnz'] = n*lp['nnz']
+
+    return stacked
+
+
+
+def _scenario_index(index):
+    if index is None:
+        return 'S'
+    return ('S',) + (index if isinstance(index, tuple) else (index,))
+
+
+def _elements(lp, index):
+    # Elements of an index set, or of the product of a tuple of index sets
+    if isinstance(index, tuple):
+        return list(product(*(lp['sets'][i].tolist() for i in index)))
+    return lp['sets'][index].tolist()
+
+
+def _index_sets(model, index):
+    return [getattr(model, i) for i in (index if isinstance(index, tuple) else (index,))]
+
+
+
+def lp_to_pyomo(lp):
+
+
+    model = ConcreteModel()
+
+    ## SETS
+    for name, elements in lp['sets'].items():
+        setattr(model, name, Set(dimen=1, ordered=True, initialize=elements))
+
+
+    ## VARIABLES
+    col_lo = [None if np.isinf(v) else v for v in lp['col_lo'].tolist()]
+    col_up = [None if np.isinf(v) else v for v in lp['col_up'].tolist()]
+    x = []
+    for name, (index, cols) in lp['columns'].items():
+        bounds = list(zip(col_lo[cols[0]:cols[-1]+1], col_up[cols[0]:cols[-1]+1]))
+        uniform = len(set(bounds)) == 1
+        if index is None:
+            var = Var(bounds=bounds[0])
+        else:
+            var = Var(*_index_sets(model, index), bounds=bounds[0] if uniform else None)
+        setattr(model, name, var)
+        if not uniform:
+            # Set in column order after construction, faster than a bounds rule
+            for v, b in zip(var.values(), bounds):
+                v.bounds = b
+        x.extend(var.values())
+
+    for col in np.flatnonzero(lp['fixed']):
+        x[col].fix(lp['col_lo'][col])
+
+
+    ## OBJECTIVE
+    nz = np.flatnonzero(lp['c'])
+    model.total_cost = Objective(expr=LinearExpression(constant=lp['c0'], linear_coefs=lp['c'][nz].tolist(),
+                                                       linear_vars=[x[j] for j in nz]), sense=minimize)
+
+
+    ## CONSTRAINTS
+    # Added by lp_constraints; _lp_rows is then the row of every constraint (None for empty rows)
+    model._lp = lp
+    model._lp_columns = x
+    model._lp_objective = model.total_cost.expr
+    model._lp_rows = None
+
+    return model
+
+
+
+def lp_constraints(model):
+
+
+    # Constraint families of a model of lp_to_pyomo, added once; other models are left as they are
+    if getattr(model, '_lp', None) is None or model._lp_rows is not None:
+        return model
+
+    lp, x = model._lp, model._lp_columns
+    csr = (lp['indptr'].tolist(), lp['indices'].tolist(), lp['data'].tolist(),
+           lp['row_lo'].tolist(), lp['row_up'].tolist())
+    rows = [None]*lp['n_rows']
+    for name, (index, family) in lp['rows'].items():
+        if index is None:
+            con = Constraint(rule=_row_rule(csr, x, {None: int(family[0])}))
+        else:
+            row_of = dict(zip(_elements(lp, index), family.tolist()))
+            con = Constraint(*_index_sets(model, index), rule=_row_rule(csr, x, row_of))
+        setattr(model, name, con)
+        for i, k in zip(_elements(lp, index) if index is not None else [None], family.tolist()):
+            if k >= 0 and i in con:
+                rows[k] = con[i]
+    model._lp_rows = rows
+
+    return model
+
+
+def lp_arrays(model):
+
+
+    # The LP of a model of lp_to_pyomo with the current variable bounds and fixings,
+    # None when the objective or the constraints were changed after building
+    lp = getattr(model, '_lp', None)
+    if lp is None:
+        return None
+
+    objectives = list(model.component_data_objects(Objective, active=True))
+    if objectives != [model.total_cost] or model.total_cost.expr is not model._lp_objective:
+        return None
+
+    # Every active constraint must be a row of the LP; deactivated rows are left free
+    active = model.component_data_objects(Constraint, active=True)
+    inactive = None
+    if model._lp_rows is None:
+        if next(active, None) is not None:
+            return None
+    else:
+        stored = ComponentSet(con for con in model._lp_rows if con is not None)
+        if any(con not in stored for con in active):
+            return None
+        inactive = np.fromiter((con is not None and not con.active for con in model._lp_rows), bool, lp['n_rows'])
+
+    n = lp['n_cols']
+    col_lo = np.fromiter((np.nan if v.lb is None else v.lb for v in model._lp_columns), float, n)
+    col_up = np.fromiter((np.nan if v.ub is None else v.ub for v in model._lp_columns), float, n)
+    fixed = np.fromiter((v.fixed for v in model._lp_columns), bool, n)
+    value = np.fromiter((v.value if v.fixed else 0.0 for v in model._lp_columns), float, n)
+    col_lo = np.where(fixed, value, np.nan_to_num(col_lo, nan=-np.inf))
+    col_up = np.where(fixed, value, np.nan_to_num(col_up, nan=np.inf))
+
+    rows = dict()
+    if inactive is not None and inactive.any():
+        rows = dict(row_lo=np.where(inactive, -np.inf, lp['row_lo']), row_up=np.where(inactive, np.inf, lp['row_up']))
+
+    return dict(lp, col_lo=col_lo, col_up=col_up, **rows)
+
+
+def n_constraints(model):
+    # Number of rows, also before lp_constraints
+    if getattr(model, '_lp', None) is not None and model._lp_rows is None:
+        return int((np.diff(model._lp['indptr']) > 0).sum())
+    return model.nconstraints()
+
+
+
+def _row_rule(csr, x, row_of):
+
+    indptr, indices, data, row_lo, row_up = csr
+    inf = float('inf')
+
+    def row(m, *i):
+        k = row_of[i if len(i) > 1 else (i[0] if i else None)]
+        if k < 0:
+            return Constraint.Skip
+        a, b = indptr[k], indptr[k+1]
+        if a == b:
+            return Constraint.Skip
+        body = LinearExpression(linear_coefs=data[a:b], linear_vars=[x[j] for j in indices[a:b]])
+        lo, up = row_lo[k], row_up[k]
+        if lo == up:
+            return body == lo
+        elif up == inf:
+            return body >= lo
+        elif lo == -inf:
+            return body <= up
+        return (lo, body, up)
+
+    return row
@@ -0,0 +1,110 @@
+from pyomo.core import Constraint
+from pyomo.repn import generate_standard_repn
+
+
+
+# Model audit pass, run on a built model before it goes to the solver.
+#
+# Every active constraint is reduced to its linear form (fixed variables are
+# moved into the bounds) and scaled so that its first coefficient is +1. Then
+#   - empty rows (no variables left) are deactivated if the constant satisfies the bounds
+#   - duplicate rows (same body and bounds) are deactivated except for the first one
+#   - dominated rows (same body, bounds not tighter than another row) are deactivated
+# The report holds the row and nonzero counts before and after and the removed rows.
+#
+# Example
+# report = audit_model(model_instance)
+# print(format_audit(report))
+# solve_model(model_instance, solver, audit=True)
+# print(format_audit(model_instance.audit_report))
+
+
+
+def _row(con):
+
+    repn = generate_standard_repn(con.body, compute_values=True, quadratic=False)
+    if not repn.is_linear():
+        return None
+
+    lo = -float('inf') if con.lower is None else con.lower() - repn.constant
+    up = float('inf') if con.upper is None else con.upper() - repn.constant
+    terms = sorted((id(v), c) for v, c in zip(repn.linear_vars, repn.linear_coefs) if c != 0)
+
+    # Scale to a leading +1 coefficient so that equivalent rows get the same body
+    if terms:
+        scale = terms[0][1]
+        terms = tuple((i, c/scale) for i, c in terms)
+        lo, up = (lo/scale, up/scale) if scale > 0 else (up/scale, lo/scale)
+
+    return tuple(terms), lo, up
+
+
+
+def _close(a, b, tol):
+    return a == b or abs(a - b) <= tol
+
+
+
+def audit_model(model_instance, deactivate=True, tol=1e-9):
+
+
+    report = {'rows_before': 0, 'nonzeros_before': 0,
+              'empty': [], 'infeasible': [], 'duplicate': [], 'dominated': []}
+
+    kept = dict()   # body -> [(lo, up, con)] of the rows kept so far
+    removed = []
+
+    for con in model_instance.component_data_objects(Constraint, active=True):
+
+        row = _row(con)
+        if row is None:
+            continue
+        body, lo, up = row
+
+        report['rows_before'] += 1
+        report['nonzeros_before'] += len(body)
+
+        if not body:
+            if lo <= tol and up >= -tol:
+                report['empty'].append(con.name)
+                removed.append((con, 0))
+            else:
+                report['infeasible'].append(con.name)
+            continue
+
+        rows = kept.setdefault(body, [])
+        for k_lo, k_up, k_con in rows:
+            if k_lo >= lo - tol and k_up <= up + tol:
+                kind = 'duplicate' if _close(k_lo, lo, tol) and _close(k_up, up, tol) else 'dominated'
+                report[kind].append(con.name)
+                removed.append((con, len(body)))
+                break
+        else:
+            rows.append((lo, up, con))
+
+
+    # Rows kept first but dominated by a later row of the same body
+    for body, rows in kept.items():
+        if len(rows) < 2:
+            continue
+        for lo, up, con in list(rows):
+            if any(o is not con and o_lo >= lo - tol and o_up <= up + tol for o_lo, o_up, o in rows):
+                report['dominated'].append(con.name)
+                removed.append((con, len(body)))
+                rows.remove((lo, up, con))
+
+
+    report['rows_after'] = report['rows_before'] - len(removed)
+    report['nonzeros_after'] = report['nonzeros_before'] - sum(nnz for con, nnz in removed)
+
+    if deactivate:
+        for con, nnz in removed:
+            con.deactivate()
+
+    return report
+
+
+def format_audit(report):
+    return ('Model audit: %d -> %d rows, %d -> %d nonzeros (%d empty, %d duplicate, %d dominated, %d infeasible)'
+            % (report['rows_before'], report['rows_after'], report['nonzeros_before'], report['nonzeros_after'],
+               len(report['empty']), len(report['duplicate']), len(report['dominated']), len(report['infeasible'])))
@@ -0,0 +1,500 @@
+from pyomo.core import ConcreteModel
+from pyomo.core import Set,Param,Var,Objective,Constraint,Suffix
+from pyomo.core import NonNegativeReals, Reals
+from pyomo.core import minimize
+from pyomo.core import value
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.repn import generate_standard_repn
+from pyomo.common.gc_manager import PauseGC
+import numpy as np
+
+from matrix_model import build_lp, lp_to_pyomo, lp_constraints, lp_series
+from data_io import series_block, indexed
+from model_audit import audit_model
+from solver_backend import run_solver, default_solver
+
+
+
+# Shared model core for microgrid_model and netmetering_model.
+#
+# Every model has the same battery, energy balance and grid exchange (energy
+# bought and sold at the energy prices); only the grid tariff differs. A tariff
+# is a module (tariff_contract.py, tariff_swedish.py) with
+#   SERIES, SCALARS     its inputs {name: default}, None = required
+#   INTEGER_SERIES      series converted to integers (e.g. month_order)
+#   tariff_rules        adds its Params, Vars and Constraints to the Pyomo model
+#   tariff_cost         its part of the objective
+#   COLUMNS, tariff_sets, tariff_lp   the same for the matrix builder (see matrix_model.py)
+#   tariff_results      adds its entries to the results dict (which already holds
+#                       cost_energy and cost_degradation)
+#   tariff_analytic     the same entries in closed form for a given grid exchange
+#   tariff_sensitivities  adds its marginal values to the results dict (see sensitivity_results)
+#
+# Without a battery the grid exchange follows from generation - demand and no LP
+# is needed: optimize_model returns analytic_results then, and builds and solves
+# the model otherwise.
+#
+# Battery cycle aging is priced with battery_degradation_cost [EUR/kWh] on the
+# discharged energy, plus battery_degradation_segments [(power [kW], extra cost
+# [EUR/kWh]), ...]: the discharge power above every segment power costs its extra
+# cost on top. The extra costs are not negative, so the cost is convex piecewise
+# linear and the model stays an LP: the discharge above the first segment power is
+# split into B_OUT_EXCESS columns bounded by the segment widths, the cheaper ones
+# fill first. Only segments add columns and rows (one column per segment and
+# period, one discharge_excess row per period).
+#
+# Example
+# import tariff_swedish
+# model_data = model_input(data, tariff_swedish)
+# model_instance = build_model(model_data, tariff_swedish, builder='matrix')
+# solve_model(model_instance, solver)
+# s = model_results(model_instance, tariff_swedish)
+# s = optimize_model(model_data, tariff_swedish, solver)
+
+
+# Shared inputs {name: default}, None = required
+SERIES = {'generation': None, 'demand': 0.0, 'energy_price_buy': None, 'energy_price_sell': None}
+
+SCALARS = {'battery_min_level': 0, 'battery_capacity': 0, 'battery_charge_max': 0, 'battery_discharge_max': 0,
+           'battery_efficiency_charge': 0, 'battery_efficiency_discharge': 0,
+           'bel_ini_level': 0, 'bel_fin_level': 0, 'battery_grid_charging': True, 'dt': 1,
+           'battery_degradation_cost': 0}
+
+
+
+def solve_model(model_instance, solver=None, audit=False, events=None, tee=True, duals=False):
+
+    # solver: solve configuration, see solver_backend.py (default_solver() when None)
+    # duals=True imports the duals and reduced costs into the Suffixes model.dual and model.rc
+    if duals:
+        for name in ('dual', 'rc'):
+            if model_instance.component(name) is None:
+                model_instance.add_component(name, Suffix(direction=Suffix.IMPORT))
+
+    # audit=True removes empty, duplicate and dominated rows before solving (see model_audit.py);
+    # the report is kept as model_instance.audit_report and sent to events as an 'audit' event
+    if audit:
+        lp_constraints(model_instance)
+        model_instance.audit_report = audit_model(model_instance)
+        if events is not None:
+            events(dict(model_instance.audit_report, event='audit'))
+
+    # events: callable receiving structured timing and status events (see instrumentation.py)
+    run_solver(model_instance, solver or default_solver(), tee=tee, events=events)
+
+
+    return model_instance
+
+
+
+def model_input(data, tariff):
+
+
+    # Time series are kept as float64 arrays (lists, arrays or DataFrame columns are accepted)
+    n = len(data['generation'])
+    series = dict(SERIES, **tariff.SERIES)
+    scalars = dict(SCALARS, **tariff.SCALARS)
+
+    d = {'T': np.arange(1, n+1)}
+    d.update(series_block(data, n, series))
+    for name in tariff.INTEGER_SERIES:
+        d[name] = d[name].astype(np.int64)
+
+    for name, default in scalars.items():
+        if name not in data and default is None:
+            raise KeyError("Missing model input '%s'" % name)
+        d[name] = data.get(name, default)
+    d['battery_degradation_segments'] = degradation_segments(data.get('battery_degradation_segments', ()))
+
+    return {None: d}
+
+
+def degradation_segments(segments):
+
+    # [(discharge power [kW], extra cost [EUR/kWh]), ...] -> (segments, 2) array by power
+    segments = np.array(segments, dtype=float).reshape(-1, 2)
+    if np.any(segments < 0):
+        raise ValueError("Degradation segment powers and extra costs must not be negative (convex cost)")
+
+    return segments[np.argsort(segments[:, 0], kind='stable')]
+
+
+def active_segments(model_data, mutable=False):
+
+    # Segments below the discharge limit, the others never apply (all of them for mutable models)
+    d = model_data[None]
+    segments = d['battery_degradation_segments']
+    return segments if mutable else segments[segments[:, 0] < d['battery_discharge_max']]
+
+
+
+def build_model(model_data, tariff, builder='rules', mutable=False):
+
+    # builder='rules' builds every constraint with a Pyomo rule per period,
+    # builder='matrix' assembles the same LP from NumPy arrays (see matrix_model.py).
+    # mutable=True makes all Params mutable so that a SolverSession can update them in place
+    # The cyclic garbage collector is paused meanwhile, its passes over the growing model
+    # cost more the larger the model gets (as in the Pyomo writers)
+    with PauseGC():
+        return _build_model(model_data, tariff, builder, mutable)
+
+
+def _build_model(model_data, tariff, builder, mutable):
+
+    if builder == 'matrix':
+        if mutable:
+            raise ValueError("The matrix builder does not support mutable Params, use builder='rules'")
+        model = lp_to_pyomo(build_lp(model_data, tariff))
+        # Shared scalar inputs as Params, as in the rules model
+        for name in SCALARS:
+            model.add_component(name, Param(initialize=model_data[None][name]))
+        if model.component('K') is not None:
+            degradation_params(model, active_segments(model_data))
+        return model
+    elif builder != 'rules':
+        raise ValueError("Unknown model builder '%s', use 'rules' or 'matrix'" % builder)
+
+
+    model = ConcreteModel()
+
+    ## SETS
+    model.T = Set(dimen=1, ordered=True, initialize=model_data[None]['T']) # Periods
+
+    model.dt = Param(initialize=model_data[None]['dt'], mutable=mutable)
+
+    battery_block(model, model_data, mutable)
+    grid_exchange_block(model, model_data, mutable)
+    energy_balance_block(model, model_data, mutable)
+    tariff.tariff_rules(model, model_data, mutable)
+
+
+    ## OBJECTIVE
+    # Minimize cost
+    def total_cost(model):
+        cost = sum(model.COST_ENERGY[t] for t in model.T) + tariff.tariff_cost(model)
+        if has_degradation(model):
+            cost += total_degradation_cost(model)
+        return cost
+    model.total_cost = Objective(rule=total_cost, sense=minimize)
+
+    return model
+
+
+
+def battery_block(model, model_data, mutable=False):
+
+
+    ## PARAMETERS
+    model.battery_min_level             = Param(initialize=model_data[None]['battery_min_level'], mutable=mutable)
+    model.battery_capacity              = Param(initialize=model_data[None]['battery_capacity'], mutable=mutable)
+    model.battery_charge_max            = Param(initialize=model_data[None]['battery_charge_max'], mutable=mutable)
+    model.battery_discharge_max         = Param(initialize=model_data[None]['battery_discharge_max'], mutable=mutable)
+    model.battery_efficiency_charge     = Param(initialize=model_data[None]['battery_efficiency_charge'], mutable=mutable)
+    model.battery_efficiency_discharge  = Param(initialize=model_data[None]['battery_efficiency_discharge'], mutable=mutable)
+    model.bel_ini_level                 = Param(initialize=model_data[None]['bel_ini_level'], mutable=mutable)
+    model.bel_fin_level                 = Param(initialize=model_data[None]['bel_fin_level'], mutable=mutable)
+    model.battery_degradation_cost      = Param(initialize=model_data[None]['battery_degradation_cost'], mutable=mutable)
+
+
+    ## VARIABLE LIMITS
+    def soc_limits(model, t):
+        return (model.battery_min_level*model.battery_capacity, model.battery_capacity)
+    def charge_limits(model, t):
+        return (0.0, model.battery_charge_max)
+    def discharge_limits(model, t):
+        return (0.0, model.battery_discharge_max)
+
+
+    ## VARIABLES
+    model.BEL               = Var(model.T, within=NonNegativeReals, bounds=soc_limits)
+    model.B_IN              = Var(model.T, within=NonNegativeReals, bounds=charge_limits)
+    model.B_OUT             = Var(model.T, within=NonNegativeReals, bounds=discharge_limits)
+
+
+    ## CONSTRAINTS
+    # Battery energy balance
+    def battery_soc(model, t):
+        if t==model.T.first():
+            return model.BEL[t] - model.bel_ini_level*model.battery_capacity == model.battery_efficiency_charge*model.B_IN[t]*model.dt  - (1/model.battery_efficiency_discharge)*model.B_OUT[t]*model.dt
+        else:
+            return model.BEL[t] - model.BEL[model.T.prev(t)] == model.battery_efficiency_charge*model.B_IN[t]*model.dt  - (1/model.battery_efficiency_discharge)*model.B_OUT[t]*model.dt
+    model.battery_soc = Constraint(model.T, rule=battery_soc)
+
+    # Fix battery soc in the last period
+    if value(model.bel_fin_level) > 0:
+        model.BEL[model.T.last()].fix(value(model.bel_fin_level*model.battery_capacity))
+
+
+    ## DEGRADATION
+    segments = active_segments(model_data, mutable)
+    if len(segments):
+        model.K = Set(dimen=1, ordered=True, initialize=range(1, len(segments)+1)) # Degradation segments
+        degradation_params(model, segments, mutable)
+
+        # Discharge power in every segment, up to the power of the next one
+        power = model.battery_degradation_power
+        K = list(model.K)
+        limits = {k: (0.0, power[k+1] - power[k] if k < K[-1] else None) for k in K}
+        def excess_limits(model, k, t):
+            return limits[k]
+        model.B_OUT_EXCESS = Var(model.K, model.T, within=NonNegativeReals, bounds=excess_limits)
+
+        # Discharge power above the power of the first segment
+        def discharge_excess(model, t):
+            return sum([model.B_OUT[t]] + [-model.B_OUT_EXCESS[k, t] for k in K]) <= power[K[0]]
+        model.discharge_excess = Constraint(model.T, rule=discharge_excess)
+
+
+def degradation_params(model, segments, mutable=False):
+    K = np.arange(1, len(segments)+1)
+    model.battery_degradation_power     = Param(model.K, initialize=indexed(segments[:, 0], K), mutable=mutable)
+    model.battery_degradation_extra     = Param(model.K, initialize=indexed(segments[:, 1], K), mutable=mutable)
+
+
+def has_degradation(model):
+    cost = model.battery_degradation_cost
+    return cost.mutable or value(cost) != 0 or model.component('K') is not None
+
+
+def degradation_coefficients(model):
+
+    # Cost of the discharge in every segment: the extra costs of segments 1..k, summed once
+    # (expressions of the Params if they are mutable, floats otherwise)
+    coefs, cost = [], 0
+    for k in model.K:
+        cost = cost + model.battery_degradation_extra[k]
+        coefs.append(cost)
+    return coefs if model.battery_degradation_extra.mutable else [value(c) for c in coefs]
+
+
+def degradation_cost(model, t, coefs=None):
+
+    # Cycle aging cost of period t; coefs from degradation_coefficients
+    cost = model.battery_degradation_cost*model.B_OUT[t]*model.dt
+    if model.component('K') is not None:
+        if coefs is None:
+            coefs = degradation_coefficients(model)
+        cost += sum(c*model.B_OUT_EXCESS[k, t] for k, c in zip(model.K, coefs))*model.dt
+    return cost
+
+
+def total_degradation_cost(model):
+
+    # Cycle aging cost of the horizon, as one linear expression unless the Params are mutable
+    if model.battery_degradation_cost.mutable:
+        coefs = degradation_coefficients(model) if model.component('K') is not None else None
+        return sum(degradation_cost(model, t, coefs) for t in model.T)
+
+    dt = value(model.dt)
+    T = list(model.T)
+    coefs, variables = [value(model.battery_degradation_cost)*dt]*len(T), [model.B_OUT[t] for t in T]
+    if model.component('K') is not None:
+        for k, c in zip(model.K, degradation_coefficients(model)):
+            coefs += [c*dt]*len(T)
+            variables += [model.B_OUT_EXCESS[k, t] for t in T]
+
+    return LinearExpression(constant=0.0, linear_coefs=coefs, linear_vars=variables)
+
+
+def degradation_results(solution):
+
+    # Cycle aging cost of every period from the solution values
+    cost = value(solution.battery_degradation_cost)*np.array(value(solution.B_OUT[:]))
+    if solution.component('K') is not None:
+        excess = np.array(value(solution.B_OUT_EXCESS[:, :])).reshape(len(solution.K), len(solution.T))
+        cost += np.array([value(c) for c in degradation_coefficients(solution)]) @ excess
+    return (cost*value(solution.dt)).tolist()
+
+
+
+def grid_exchange_block(model, model_data, mutable=False):
+
+
+    ## PARAMETERS
+    model.energy_price_buy              = Param(model.T, initialize=indexed(model_data[None]['energy_price_buy'], model_data[None]['T']), mutable=mutable)
+    model.energy_price_sell             = Param(model.T, initialize=indexed(model_data[None]['energy_price_sell'], model_data[None]['T']), mutable=mutable)
+
+
+    ## VARIABLES
+    model.COST_ENERGY       = Var(model.T, within=Reals)
+    model.P_BUY             = Var(model.T, within=NonNegativeReals)
+    model.P_SELL            = Var(model.T, within=NonNegativeReals)
+
+
+    ## CONSTRAINTS
+    # Energy cost
+    def energy_cost(model, t):
+        return model.COST_ENERGY[t] == model.energy_price_buy[t]*model.P_BUY[t]*model.dt - model.energy_price_sell[t]*model.P_SELL[t]*model.dt
+    model.energy_cost = Constraint(model.T, rule=energy_cost)
+
+
+
+def energy_balance_block(model, model_data, mutable=False):
+
+
+    ## PARAMETERS
+    model.demand                        = Param(model.T, within=Reals, initialize=indexed(model_data[None]['demand'], model_data[None]['T']), mutable=mutable)
+    model.generation                    = Param(model.T, initialize=indexed(model_data[None]['generation'], model_data[None]['T']), mutable=mutable)
+    model.battery_grid_charging         = Param(initialize=model_data[None]['battery_grid_charging'])
+
+
+    ## CONSTRAINTS
+    # Energy balance
+    def energy_balance(model, t):
+        return model.P_SELL[t] - model.P_BUY[t] ==  model.generation[t] + model.B_OUT[t] - model.B_IN[t] - model.demand[t]
+    model.energy_balance = Constraint(model.T, rule=energy_balance)
+
+
+    # Battery charging from grid
+    def no_grid_charging(model, t):
+        if value(model.battery_grid_charging) == False:
+            return model.P_BUY[t] <= model.demand[t]
+        else:
+            return Constraint.Skip
+    model.no_grid_charging = Constraint(model.T, rule=no_grid_charging)
+
+
+
+def model_results(solution, tariff):
+
+    s = dict()
+    s['cost_energy'] = value(solution.COST_ENERGY[:])
+    if has_degradation(solution):
+        s['cost_degradation'] = degradation_results(solution)
+    else:
+        s['cost_degradation'] = [0.0]*len(solution.T)
+
+    tariff.tariff_results(solution, s)
+
+    s['power_buy'] = value(solution.P_BUY[:])
+    s['power_sell'] = value(solution.P_SELL[:])
+
+    s['battery_soc'] = value(solution.BEL[:])
+    s['battery_charge'] = value(solution.B_IN[:])
+    s['battery_discharge'] = value(solution.B_OUT[:])
+
+    # Marginal values when the model was solved with duals=True
+    if isinstance(solution.component('dual'), Suffix) and isinstance(solution.component('rc'), Suffix):
+        sensitivity_results(solution, tariff, s)
+
+    return s
+
+
+
+def _coefficient(con, var):
+
+    # Coefficient of var in the body of the constraint, also for a fixed var
+    fixed = var.fixed
+    var.unfix()
+    repn = generate_standard_repn(con.body, compute_values=True, quadratic=False)
+    if fixed:
+        var.fix()
+
+    return sum(c for v, c in zip(repn.linear_vars, repn.linear_coefs) if v is var)
+
+
+def dual_marginal(solution, var, *rows):
+
+    # d total_cost / d var for a var that is not in the objective (e.g. a fixed one):
+    # minus the duals of the rows holding var times its coefficient. Every argument
+    # is a list of rows in which var has the same coefficient.
+    total = 0.0
+    for family in rows:
+        family = [con for con in family if con.active]
+        if family:
+            total -= _coefficient(family[0], var)*sum(solution.dual.get(con, 0.0) for con in family)
+
+    return total
+
+
+def sensitivity_results(solution, tariff, s):
+
+    # Marginal values of the inputs (d total_cost / d input, valid for small changes)
+    #   marginal_battery_capacity       [EUR/kWh] soc limits and initial / final soc
+    #   marginal_battery_charge_max     [EUR/kW]
+    #   marginal_battery_discharge_max  [EUR/kW]
+    #   shadow_price_energy             [EUR/kWh] cost of one more kWh of demand in every period
+    # plus the entries of tariff_sensitivities
+    T = list(solution.T)
+    first, last = T[0], T[-1]
+    rc = solution.rc
+
+    # Reduced costs < 0 at the upper bound, > 0 at the lower bound; a fixed final soc is priced below
+    bel_rc = np.array([0.0 if solution.BEL[t].fixed else rc.get(solution.BEL[t], 0.0) for t in T])
+    capacity = np.minimum(bel_rc, 0.0).sum() + np.maximum(bel_rc, 0.0).sum()*value(solution.battery_min_level)
+    first_soc = solution.battery_soc[first]
+    capacity += solution.dual.get(first_soc, 0.0)*_coefficient(first_soc, solution.BEL[first])*value(solution.bel_ini_level)
+    if solution.BEL[last].fixed:
+        capacity += dual_marginal(solution, solution.BEL[last], [solution.battery_soc[last]])*value(solution.bel_fin_level)
+    s['marginal_battery_capacity'] = float(capacity)
+
+    s['marginal_battery_charge_max'] = float(sum(min(rc.get(solution.B_IN[t], 0.0), 0.0) for t in T))
+    s['marginal_battery_discharge_max'] = float(sum(min(rc.get(solution.B_OUT[t], 0.0), 0.0) for t in T))
+
+    # energy_balance: P_SELL - P_BUY - B_OUT + B_IN == generation - demand (up to the sign of the row)
+    a = _coefficient(solution.energy_balance[first], solution.P_SELL[first])
+    dt = value(solution.dt)
+    s['shadow_price_energy'] = [-a*solution.dual.get(solution.energy_balance[t], 0.0)/dt for t in T]
+
+    tariff.tariff_sensitivities(solution, s)
+
+
+
+def has_battery(model_data):
+
+    # No battery: nothing can be stored (capacity 0) and nothing charged, so that
+    # B_IN, B_OUT and BEL are 0 in every solution
+    d = model_data[None]
+    return d['battery_capacity'] != 0 or d['battery_charge_max'] != 0
+
+
+def analytic_results(model_data, tariff):
+
+    # Results of the model in closed form, None when the LP is needed.
+    # Without a battery, buying and selling in the same period never pays when
+    # price_buy >= price_sell and the tariff fees are not negative, so the grid
+    # exchange is the deficit / surplus of every period.
+    if has_battery(model_data):
+        return None
+
+    d = model_data[None]
+    dt = d['dt']
+    price_buy, price_sell = lp_series(model_data, 'energy_price_buy'), lp_series(model_data, 'energy_price_sell')
+    if np.any(price_buy < price_sell):
+        return None
+
+    net = lp_series(model_data, 'generation') - lp_series(model_data, 'demand')
+    p_buy, p_sell = np.maximum(-net, 0.0), np.maximum(net, 0.0)
+    if not d['battery_grid_charging'] and np.any(p_buy > lp_series(model_data, 'demand')):
+        return None
+
+    tariff_s = tariff.tariff_analytic(model_data, p_buy, p_sell)
+    if tariff_s is None:
+        return None
+
+    s = dict()
+    s['cost_energy'] = ((price_buy*p_buy - price_sell*p_sell)*dt).tolist()
+    s['cost_degradation'] = [0.0]*len(net)
+    s.update(tariff_s)
+
+    s['power_buy'] = p_buy.tolist()
+    s['power_sell'] = p_sell.tolist()
+
+    zero = [0.0]*len(net)
+    s['battery_soc'] = zero
+    s['battery_charge'] = list(zero)
+    s['battery_discharge'] = list(zero)
+
+    return s
+
+
+def optimize_model(model_data, tariff, solver=None, builder='rules', tee=True):
+
+    # Results dict of model_results, analytic when possible, else from the LP
+    s = analytic_results(model_data, tariff)
+    if s is None:
+        model_instance = build_model(model_data, tariff, builder)
+        solve_model(model_instance, solver, tee=tee)
+        s = model_results(model_instance, tariff)
+
+    return s
@@ -0,0 +1,195 @@
+from concurrent.futures import ProcessPoolExecutor
+from pyomo.core import Suffix
+from pyomo.core import value
+import numpy as np
+
+from swedish_tariff_model import netmetering_model, netmetering_model_input, netmetering_model_results, solve_model
+from data_io import is_schedule
+
+
+
+# Monthly decomposition of netmetering_model.
+#
+# The monthly peak charges COST_GRID_POWER_MAX[m] only couple periods of the same
+# month, so the year splits on month_order into one LP per month. With
+# data['timestamps'] a month is a (year, month) pair, so that a horizon longer
+# than a year gets one LP per calendar month; without timestamps a month number
+# must not come back after other months. Months are only linked by the battery
+# soc at the month boundaries:
+#   - the boundary soc is first fixed (fixed-soc heuristic, default bel_ini_level)
+#     and all months are solved in parallel in a process pool
+#   - with iterations > 0 the boundary socs are then moved along the marginal
+#     values of the month LPs (dual of the first soc balance and of the last one)
+#     with a step that is halved whenever the total cost does not improve
+#
+# Every month LP charges grid_fixed_fee once, so the sum of the month objectives
+# is the monolithic objective of the joined dispatch. With monolithic=True the
+# full-year LP is solved alongside for reference (with the same months).
+# Solver output is shown with tee=True.
+#
+# Example
+# s = netmetering_decomposed(data, solver, iterations=5, max_workers=8)
+# print(s['objective'], s['boundary_soc'])
+
+
+# Inputs that are sliced per month
+TIME_SERIES = ['generation', 'demand', 'energy_price_buy', 'energy_price_sell',
+               'grid_energy_import_fee', 'grid_energy_export_fee',
+               'grid_power_import_fee', 'grid_power_export_fee', 'month_order', 'timestamps']
+
+# Results that are joined over the months
+TIME_SERIES_RESULTS = ['cost_energy', 'cost_degradation', 'cost_grid_energy_import', 'cost_grid_energy_export',
+                       'cost_grid_power', 'cost_grid_power_max',
+                       'power_buy', 'power_sell', 'battery_soc', 'battery_charge', 'battery_discharge']
+
+
+
+def month_keys(data):
+
+    # Month of every period: year*12 + month - 1 with data['timestamps'], else month_order
+    month_order = np.asarray(data['month_order'])
+    if data.get('timestamps') is None:
+        return month_order
+
+    import pandas as pd
+    years = pd.DatetimeIndex(data['timestamps']).year.to_numpy()
+    return years*12 + month_order - 1
+
+
+def month_blocks(month_keys):
+
+    # (start, end) of every run of equal months, every month must be one run
+    month_keys = np.asarray(month_keys)
+    cuts = np.flatnonzero(month_keys[1:] != month_keys[:-1]) + 1
+    starts = np.concatenate(([0], cuts))
+    ends = np.concatenate((cuts, [len(month_keys)]))
+
+    runs = month_keys[starts]
+    if len(np.unique(runs)) < len(runs):
+        raise ValueError("Months come back after other months, give data['timestamps'] so that "
+                         "the same month of different years is told apart")
+
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def _solve_month(data, solver, tee=False):
+
+    model_instance = netmetering_model(netmetering_model_input(data))
+    model_instance.dual = Suffix(direction=Suffix.IMPORT)
+    solve_model(model_instance, solver, tee=tee)
+
+    r = dict()
+    r['results'] = netmetering_model_results(model_instance)
+    r['objective'] = value(model_instance.total_cost)
+
+    # Marginal cost of the soc level [share of capacity] at the start and at the end of the month
+    capacity = data.get('battery_capacity', 0)
+    first = model_instance.battery_soc[model_instance.T.first()]
+    last = model_instance.battery_soc[model_instance.T.last()]
+    r['marginal_start'] = model_instance.dual.get(first, 0.0)*capacity
+    if model_instance.BEL[model_instance.T.last()].fixed:
+        r['marginal_end'] = -model_instance.dual.get(last, 0.0)*capacity
+    else:
+        r['marginal_end'] = 0.0
+
+    return r
+
+
+def _solve_year(data, solver, tee=False):
+
+    # The months of the decomposition as month_order
+    model_instance = netmetering_model(netmetering_model_input(dict(data, month_order=month_keys(data))))
+    solve_model(model_instance, solver, tee=tee)
+
+    return value(model_instance.total_cost)
+
+
+def _month_data(data, blocks, boundary_soc):
+
+    ini = [data.get('bel_ini_level', 0)] + list(boundary_soc)
+    fin = list(boundary_soc) + [data.get('bel_fin_level', 0)]
+
+    months = []
+    for k, (start, end) in enumerate(blocks):
+        d = dict(data)
+        for key in TIME_SERIES:
+            # Scalars and schedules (expanded over the sliced timestamps) hold for every month
+            if key in data and np.ndim(data[key]) > 0 and not is_schedule(data[key]):
+                d[key] = data[key][start:end]
+        d['bel_ini_level'] = ini[k]
+        d['bel_fin_level'] = fin[k]
+        months.append(d)
+
+    return months
+
+
+def _solve_months(pool, data, blocks, boundary_soc, solver, tee):
+
+    months = _month_data(data, blocks, boundary_soc)
+    return list(pool.map(_solve_month, months, [solver]*len(months), [tee]*len(months)))
+
+
+
+def netmetering_decomposed(data, solver, boundary_soc=None, iterations=0, step=0.25,
+                           max_workers=None, monolithic=False, tee=False):
+
+
+    blocks = month_blocks(month_keys(data))
+    n_boundaries = len(blocks) - 1
+
+    # Boundary soc as share of capacity; bel_fin_level > 0 is needed to fix it in the month LPs
+    lowest = max(data.get('battery_min_level', 0), 1e-6)
+    if boundary_soc is None:
+        boundary_soc = data.get('bel_ini_level', 0)
+    boundary_soc = np.clip(np.broadcast_to(np.asarray(boundary_soc, dtype=float), (n_boundaries,)), lowest, 1.0)
+
+    coupled = data.get('battery_capacity', 0) > 0 and n_boundaries > 0
+
+
+    with ProcessPoolExecutor(max_workers) as pool:
+
+        if monolithic:
+            year = pool.submit(_solve_year, data, solver, tee)
+
+        months = _solve_months(pool, data, blocks, boundary_soc, solver, tee)
+        objective = sum(m['objective'] for m in months)
+        history = [objective]
+
+        for it in range(iterations if coupled else 0):
+
+            # d cost / d boundary soc: end of the month before plus start of the month after
+            gradient = np.array([months[k]['marginal_end'] + months[k+1]['marginal_start'] for k in range(n_boundaries)])
+            if not np.any(gradient):
+                break
+
+            trial_soc = np.clip(boundary_soc - step*np.sign(gradient), lowest, 1.0)
+            trial = _solve_months(pool, data, blocks, trial_soc, solver, tee)
+            trial_objective = sum(m['objective'] for m in trial)
+
+            if trial_objective < objective:
+                boundary_soc, months, objective = trial_soc, trial, trial_objective
+            else:
+                step = step/2
+            history.append(objective)
+
+        if monolithic:
+            objective_monolithic = year.result()
+
+
+    # Join the months
+    s = {k: [] for k in TIME_SERIES_RESULTS}
+    for m in months:
+        for k in TIME_SERIES_RESULTS:
+            s[k].extend(m['results'][k])
+    s['cost_grid_power_fixed'] = sum(m['results']['cost_grid_power_fixed'] for m in months)
+    s['cost_total'] = sum(m['results']['cost_total'] for m in months)
+
+    s['objective'] = objective
+    s['objective_history'] = history
+    s['boundary_soc'] = boundary_soc.tolist()
+
+    if monolithic:
+        s['objective_monolithic'] = objective_monolithic
+        s['gap'] = (objective - objective_monolithic)/abs(objective_monolithic) if objective_monolithic else 0.0
+
+    return s
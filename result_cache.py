@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+from model import microgrid_optimize
+from swedish_tariff_model import netmetering_optimize
+from solver_backend import default_solver
+
+
+
+# Content-addressed on-disk cache for solved scenarios.
+#
+# The key is a SHA-256 over the normalized model_data (time series as float64
+# arrays, scalars by value), the model kind and the normalized solve
+# configuration (see solver_backend.py: name, path, threads, time_limit, mip_gap,
+# options and fallbacks, since all of them can change the result). The results
+# dict of microgrid_results / netmetering_model_results is stored as one
+# compressed .npz file per key (one array per result, None entries are listed
+# under NONE_KEY). Every writer writes its own temporary file, which replaces the
+# entry at once. The least recently used entries are evicted when max_entries or
+# max_bytes is exceeded.
+#
+# Example
+# cache = ResultCache('.cache/results', max_bytes=500e6)
+# s = cache.solve(model_data, solver)                  # solves and stores
+# s = cache.solve(model_data, solver)                  # loaded from disk
+# s = cache.solve(model_data, solver, bypass=True)     # solves again and refreshes the entry
+
+
+MODELS = {'microgrid': microgrid_optimize, 'netmetering': netmetering_optimize}
+
+# Entry of a stored results dict listing the results that are None
+NONE_KEY = '__none__'
+
+
+
+def solver_key(solver):
+
+    # Solve configuration as canonical JSON: sorted keys, fallback names as configurations.
+    # None is the default solver, as in solve_model
+    solver = dict(solver or default_solver())
+    if 'fallback' in solver:
+        solver['fallback'] = [{'name': f} if isinstance(f, str) else f for f in solver['fallback']]
+
+    return json.dumps(solver, sort_keys=True, default=repr)
+
+
+def model_data_key(model_data, solver, kind='microgrid'):
+
+    h = hashlib.sha256()
+    h.update(kind.encode())
+    h.update(solver_key(solver).encode())
+
+    d = model_data[None]
+    for name in sorted(d):
+        x = d[name]
+        if isinstance(x, dict):
+            x = list(x.values())
+        h.update(name.encode())
+        if np.ndim(x) > 0:
+            x = np.ascontiguousarray(x, dtype=np.float64)
+            h.update(b'a%d' % len(x))
+            h.update(x.tobytes())
+        else:
+            h.update(b's' + repr(x.item() if isinstance(x, np.generic) else x).encode())
+
+    return h.hexdigest()
+
+
+
+class ResultCache:
+
+    def __init__(self, path, max_entries=None, max_bytes=None):
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+
+    def get(self, key):
+
+        f = self._file(key)
+        if not os.path.exists(f):
+            return None
+
+        with np.load(f) as stored:
+            s = {k: (stored[k].item() if stored[k].ndim == 0 else stored[k].tolist()) for k in stored.files if k != NONE_KEY}
+            if NONE_KEY in stored.files:
+                s.update(dict.fromkeys(stored[NONE_KEY].tolist()))
+
+        # Last access time drives the LRU eviction
+        os.utime(f)
+
+        return s
+
+
+    def put(self, key, s):
+
+        # None entries are stored by name, None inside a series becomes NaN
+        arrays = {k: np.asarray(v, dtype=np.float64) for k, v in s.items() if v is not None}
+        none = [k for k, v in s.items() if v is None]
+        if none:
+            arrays[NONE_KEY] = np.array(none)
+
+        fd, tmp = tempfile.mkstemp(suffix='.tmp.npz', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        self.evict()
+
+
+    def evict(self):
+
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                st = os.stat(os.path.join(self.path, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+
+        total = sum(e[1] for e in entries)
+        while entries and ((self.max_entries is not None and len(entries) > self.max_entries) or
+                           (self.max_bytes is not None and total > self.max_bytes)):
+            mtime, size, name = entries.pop(0)
+            os.remove(os.path.join(self.path, name))
+            total -= size
+
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                os.remove(os.path.join(self.path, name))
+
+
+    def solve(self, model_data, solver=None, kind='microgrid', bypass=False, tee=False):
+
+        # bypass=True always solves and overwrites the stored entry; tee=True prints the solver log
+        key = model_data_key(model_data, solver, kind)
+
+        if not bypass:
+            s = self.get(key)
+            if s is not None:
+                self.hits += 1
+                return s
+
+        self.misses += 1
+        s = MODELS[kind](model_data, solver, tee=tee)
+        self.put(key, s)
+
+        return s
@@ -0,0 +1,91 @@
+from pyomo.core import Var, Constraint
+import numpy as np
+import pandas as pd
+
+
+
+# Bulk results extraction for microgrid_model and netmetering_model.
+#
+# All variables indexed by the periods T are read in one pass into a single
+# (periods x columns) float64 block. results_frame wraps the block in a
+# DataFrame and results_array in a structured NumPy array; both are views of the
+# same memory, so df.to_numpy() or arr['P_BUY'] do not copy.
+#
+# Duals and reduced costs are added as 'dual_<constraint>' / 'rc_<variable>'
+# columns when the model was solved with solve_model(..., duals=True), i.e. with the Suffixes
+#     model.dual = Suffix(direction=Suffix.IMPORT)
+#     model.rc = Suffix(direction=Suffix.IMPORT)
+# Variables that are not indexed by T (P_CONTR, COST_GRID_POWER_MAX, ...) are
+# returned by scalar_results.
+#
+# Example
+# df = results_frame(solution, index=input_df.index)
+# plt.plot(df['BEL'])
+
+
+
+def _suffix(solution, name):
+    suffix = getattr(solution, name, None)
+    if suffix is None:
+        raise ValueError("Model has no '%s' Suffix, declare it before solving" % name)
+    return suffix
+
+
+def period_columns(solution, duals=False, reduced_costs=False):
+
+
+    n = len(solution.T)
+    periods = solution.T
+    columns = []
+
+    for var in solution.component_objects(Var, descend_into=False):
+        if var.is_indexed() and var.index_set() is periods:
+            columns.append((var.name, [v.value for v in var.values()]))
+            if reduced_costs:
+                rc = _suffix(solution, 'rc')
+                columns.append(('rc_' + var.name, [rc.get(v) for v in var.values()]))
+
+    if duals:
+        dual = _suffix(solution, 'dual')
+        for con in solution.component_objects(Constraint, active=True, descend_into=False):
+            if con.is_indexed() and con.index_set() is periods and len(con) > 0:
+                # Skipped rows have no dual
+                columns.append(('dual_' + con.name, [dual.get(con[t]) if t in con else None for t in periods]))
+
+    # One C-contiguous block, None (no value) becomes NaN
+    block = np.empty((n, len(columns)))
+    for j, (name, values) in enumerate(columns):
+        block[:, j] = np.array(values, dtype=float)
+
+    return [name for name, values in columns], block
+
+
+
+def results_frame(solution, index=None, duals=False, reduced_costs=False):
+
+    # index: e.g. the timestamps of the input DataFrame, defaults to the periods T
+    names, block = period_columns(solution, duals, reduced_costs)
+    if index is None:
+        index = pd.Index(list(solution.T), name='T')
+
+    return pd.DataFrame(block, index=index, columns=names, copy=False)
+
+
+def results_array(solution, duals=False, reduced_costs=False):
+
+    names, block = period_columns(solution, duals, reduced_costs)
+
+    return block.view(np.dtype([(name, np.float64) for name in names])).reshape(len(block))
+
+
+def scalar_results(solution):
+
+    # Variables not indexed by T: scalars as floats, other index sets as {index: value}
+    s = dict()
+    for var in solution.component_objects(Var, descend_into=False):
+        if not var.is_indexed():
+            s[var.name] = var.value
+        elif var.index_set() is not solution.T:
+            s[var.name] = {i: v.value for i, v in var.items()}
+
+    return s
@@ -0,0 +1,113 @@
+from model import microgrid_model, microgrid_data_input, microgrid_results
+from solver_session import SolverSession
+
+
+
+# Rolling-horizon (model predictive control) driver for microgrid_model.
+#
+# The horizon is solved in windows of `window` periods. Only the first `step`
+# periods of every window are committed, the remaining `overlap` periods
+# (window = step + overlap) act as look-ahead. The battery soc at the end of the
+# committed periods becomes bel_ini_level of the next window, and the power
+# contract / overcharge reached so far are lower bounds for the next window.
+#
+# The model is built once for the window length and kept in a SolverSession,
+# every further window only updates the time-series Params and re-solves warm.
+# Results are yielded window by window.
+#
+# Example
+# for w in rolling_horizon(data, window=96*2, step=96):
+#     print(w['start'], sum(w['power_buy']))
+
+
+# Params that change from window to window
+TIME_SERIES = ['generation', 'demand', 'energy_price_buy', 'energy_price_sell']
+
+# Results that are cut to the committed periods
+TIME_SERIES_RESULTS = ['cost_energy', 'cost_degradation', 'cost_grid_energy', 'power_buy', 'power_sell',
+                       'battery_soc', 'battery_charge', 'battery_discharge']
+
+
+
+def rolling_horizon(data, window, step=None, overlap=None, solver=None):
+
+
+    n = len(data['generation'])
+
+    if step is None:
+        step = window - (overlap or 0)
+    elif overlap is not None and step + overlap != window:
+        raise ValueError("window must equal step + overlap")
+    if not 0 < step <= window:
+        raise ValueError("step must be between 1 and window")
+
+    window = min(window, n)
+    series = [k for k in TIME_SERIES if k in data]
+
+    capacity = data.get('battery_capacity', 0)
+    bel_ini_level = data.get('bel_ini_level', 0)
+    contract, overcharge = 0.0, 0.0
+    session = None
+
+
+    for start in range(0, n, step):
+
+        end = min(start + window, n)
+        last = end == n
+
+        # Window data: sliced time series, carried soc, final soc only at the end of the horizon
+        w = dict(data)
+        for k in series:
+            w[k] = data[k][start:end]
+        w['bel_ini_level'] = bel_ini_level
+        w['bel_fin_level'] = data.get('bel_fin_level', 0) if last else 0
+
+        if end - start == window and session is not None:
+            session.update(bel_ini_level=w['bel_ini_level'], bel_fin_level=w['bel_fin_level'],
+                           **{k: w[k] for k in series})
+            current = session
+        else:
+            # First window, or a shorter window at the end of the horizon
+            current = SolverSession(microgrid_model(microgrid_data_input(w), mutable=True), solver)
+            if session is None:
+                session = current
+
+        model = current.model
+        model.P_CONTR.setlb(contract)
+        model.P_OVER.setlb(overcharge)
+        current.update_variables([model.P_CONTR, model.P_OVER])
+
+        s = microgrid_results(current.solve())
+
+
+        # Commit the first step periods (all of them in the last window)
+        commit = end - start if last else step
+        for k in TIME_SERIES_RESULTS:
+            s[k] = s[k][:commit]
+        s['start'] = start
+        s['periods'] = range(start, start + commit)
+
+        if capacity > 0:
+            bel_ini_level = s['battery_soc'][-1]/capacity
+        contract = max(contract, s['power_contract'])
+        overcharge = max(overcharge, s['power_overcharge'])
+
+        yield s
+
+        if last:
+            break
+
+
+
+def rolling_horizon_results(windows):
+
+    # Merge the windows of rolling_horizon into one dictionary with the keys of microgrid_results.
+    # Contract and overcharge only grow from window to window, so the last window holds the horizon values.
+    s = {k: [] for k in TIME_SERIES_RESULTS}
+    for w in windows:
+        for k in TIME_SERIES_RESULTS:
+            s[k].extend(w[k])
+        for k in ['cost_grid_power', 'power_overcharge', 'power_contract']:
+            s[k] = w[k]
+
+    return s
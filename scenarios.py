@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import pandas as pd
+import numpy as np
+
+from model import microgrid_data_input, microgrid_optimize, microgrid_results_analysis
+from financial_kpis import financial_kpis_batch
+
+
+
+# Batch scenario runner for sizing studies with microgrid_model.
+#
+# The shared time series are converted with microgrid_data_input once and sent
+# to every worker process once (pool initializer); a scenario only carries the
+# scalar inputs it overrides. Scenarios are given as a parameter grid
+# {name: [values]} (all combinations) or as a DataFrame with one row per scenario.
+# Scenarios without a battery, like the no-battery reference, are computed in
+# closed form without the LP (see model_core.analytic_results).
+#
+# Example
+# grid = {'battery_capacity': [50, 100, 200], 'battery_charge_max': [25, 50], 'grid_power_contract': [0, 10]}
+# financial = {'invest_cost': lambda sc: 400*sc['battery_capacity'], 'discount_rate': 0.08,
+#              'project_lifespan': 15, 'savings_factor': 365/104}
+# df = run_scenarios(data, grid, solver, max_workers=4, progress=True, financial=financial)
+
+
+# Model inputs of the no-battery reference used for the savings
+NO_BATTERY = {'battery_capacity': 0, 'battery_charge_max': 0, 'battery_discharge_max': 0,
+              'bel_ini_level': 0, 'bel_fin_level': 0}
+
+
+_shared = dict()
+
+
+def _init_worker(model_data, solver, builder):
+    _shared['model_data'] = model_data
+    _shared['solver'] = solver
+    _shared['builder'] = builder
+
+
+def _run_scenario(overrides):
+
+    model_data = {None: dict(_shared['model_data'][None], **overrides)}
+    s = microgrid_optimize(model_data, _shared['solver'], _shared['builder'], tee=False)
+    r = microgrid_results_analysis(s)
+    r['power_contract'] = s['power_contract']
+    r['power_overcharge'] = s['power_overcharge']
+
+    return r
+
+
+def scenario_table(scenarios):
+
+    # Parameter grid -> all combinations, DataFrame -> one scenario per row
+    if isinstance(scenarios, pd.DataFrame):
+        return scenarios.reset_index(drop=True)
+
+    names = list(scenarios)
+    return pd.DataFrame(list(product(*(scenarios[k] for k in names))), columns=names)
+
+
+def _print_progress(done, total, scenario):
+    print('Scenario %d/%d done: %s' % (done, total, scenario))
+
+
+
+def run_scenarios(data, scenarios, solver, max_workers=None, progress=None, financial=None, builder='rules'):
+
+
+    table = scenario_table(scenarios)
+    model_data = microgrid_data_input(data)
+
+    unknown = [k for k in table.columns if k not in model_data[None] or np.ndim(model_data[None][k]) > 0]
+    if unknown:
+        raise ValueError("Scenario columns must be scalar model inputs, got %s" % unknown)
+
+    if progress is True:
+        progress = _print_progress
+
+    tasks = [{k: (v.item() if isinstance(v, np.generic) else v) for k, v in row.items()}
+             for row in table.to_dict('records')]
+    if financial is not None:
+        tasks.append(dict(NO_BATTERY, **financial.get('baseline', dict())))
+
+
+    results = [None]*len(tasks)
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(model_data, solver, builder)) as pool:
+
+        futures = {pool.submit(_run_scenario, task): i for i, task in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                results[i] = dict(future.result(), status='ok')
+            except Exception as e:
+                results[i] = {'status': 'failed: %s' % e}
+            if progress:
+                progress(done, len(tasks), tasks[i])
+
+
+    if financial is not None:
+        baseline = results.pop()
+        if baseline['status'] != 'ok':
+            raise RuntimeError("No-battery reference scenario %s" % baseline['status'])
+
+    out = pd.concat([table, pd.DataFrame(results)], axis=1)
+
+
+    # Financial KPIs against the no-battery reference, all scenarios at once
+    if financial is not None:
+        ok = out['status'] == 'ok'
+        total_cost = out['total_cost'] if 'total_cost' in out else pd.Series(np.nan, index=out.index)
+        savings = (baseline['total_cost'] - total_cost.where(ok))*financial.get('savings_factor', 1.0)
+        invest_cost = pd.Series([financial['invest_cost'](sc) if callable(financial['invest_cost']) else financial['invest_cost']
+                                 for sc in tasks[:len(out)]], index=out.index, dtype=float).where(ok)
+        kpis = financial_kpis_batch(invest_cost.to_numpy(), savings.to_numpy(), financial['discount_rate'],
+                                    financial['project_lifespan'])
+        kpis = pd.DataFrame(dict({'invest_cost': invest_cost, 'savings': savings}, **kpis), index=out.index).where(ok)
+        out = pd.concat([out, kpis], axis=1)
+
+    return out
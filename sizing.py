@@ -0,0 +1,178 @@
+from concurrent.futures import ProcessPoolExecutor
+from pyomo.core import value
+import pandas as pd
+import numpy as np
+
+from model import microgrid_data_input, microgrid_optimize, microgrid_results_analysis, solve_model
+from aggregation import representative_days, aggregated_model, PERIODS_PER_DAY
+from financial_kpis import financial_kpis_batch
+from scenarios import NO_BATTERY
+
+
+
+# Sizing search for battery and power contract with microgrid_model.
+#
+# Looks for the configuration with the highest NPV (financial_kpis) on a grid of
+# candidate values {name: [values]} (battery_capacity, battery_charge_max,
+# battery_discharge_max, grid_power_contract, ...) without solving every
+# combination. battery_discharge_max follows battery_charge_max unless it has
+# its own values.
+#
+# Bounded integer pattern search on the grid positions: from the current best
+# configuration, the neighbours at +-step along every axis are evaluated in
+# parallel; the search moves to the best one, or halves the steps when none is
+# better, and stops when the steps are 1 and nothing improves.
+#
+# Every new candidate is first screened with the representative-day model
+# (aggregation.py, k days). The screening savings plus a margin give an
+# optimistic NPV; candidates whose optimistic NPV is below the best full NPV are
+# pruned, the others are solved at full resolution. The margin is the largest of
+# `margin` and twice the relative screening error seen on the fully solved
+# candidates (share of the no-battery cost).
+#
+# Savings are the cost reduction against the no-battery reference times
+# savings_factor (e.g. 365/days of the horizon for annual savings).
+#
+# Example
+# space = {'battery_capacity': [0, 25, 50, 100, 150, 200, 300], 'battery_charge_max': [10, 25, 50, 100],
+#          'grid_power_contract': [0, 5, 10, 20]}
+# financial = {'invest_cost': lambda sc: 300*sc['battery_capacity'] + 100*sc['battery_charge_max'],
+#              'discount_rate': 0.08, 'project_lifespan': 15, 'savings_factor': 365/104}
+# r = sizing_search(data, space, solver, financial, k=8, max_workers=4)
+# r['best'], r['pareto']
+
+
+
+_shared = dict()
+
+
+def _init_worker(model_data, agg, solver, builder):
+    _shared['model_data'] = model_data
+    _shared['agg'] = agg
+    _shared['solver'] = solver
+    _shared['builder'] = builder
+
+
+def _evaluate(task):
+
+    # ('full', overrides): total cost at full resolution, ('screen', overrides): on the representative days
+    mode, overrides = task
+    if mode == 'full':
+        model_data = {None: dict(_shared['model_data'][None], **overrides)}
+        return microgrid_results_analysis(microgrid_optimize(model_data, _shared['solver'], _shared['builder'], tee=False))['total_cost']
+
+    agg = dict(_shared['agg'], model_data={None: dict(_shared['agg']['model_data'][None], **overrides)})
+    model_instance = aggregated_model(agg, _shared['builder'])
+    solve_model(model_instance, _shared['solver'], tee=False)
+    return value(model_instance.total_cost)
+
+
+def pareto_front(df, cost='invest_cost', benefit='savings'):
+
+    # Rows not dominated by a cheaper (or equally cheap) row with higher benefit
+    df = df.sort_values([cost, benefit], ascending=[True, False])
+    keep = df[benefit] > df[benefit].cummax().shift(fill_value=-np.inf)
+
+    return df[keep].reset_index(drop=True)
+
+
+
+def sizing_search(data, space, solver, financial, k=8, periods_per_day=PERIODS_PER_DAY, margin=0.01,
+                  start=None, max_workers=None, progress=None, builder='rules'):
+
+
+    model_data = microgrid_data_input(data)
+    names = list(space)
+    axes = [list(space[name]) for name in names]
+    unknown = [n for n in names if n not in model_data[None] or np.ndim(model_data[None][n]) > 0]
+    if unknown:
+        raise ValueError("Sizing parameters must be scalar model inputs, got %s" % unknown)
+
+    def overrides(position):
+        o = {n: (v.item() if isinstance(v, np.generic) else v) for n, v in zip(names, (a[i] for a, i in zip(axes, position)))}
+        if 'battery_charge_max' in o and 'battery_discharge_max' not in o:
+            o['battery_discharge_max'] = o['battery_charge_max']
+        return o
+
+    def invest(o):
+        return financial['invest_cost'](o) if callable(financial['invest_cost']) else financial['invest_cost']
+
+    def npv(invest_cost, savings):
+        return financial_kpis_batch(np.asarray(invest_cost, dtype=float), np.asarray(savings, dtype=float),
+                                    financial['discount_rate'], financial['project_lifespan'])['npv']
+
+    factor = financial.get('savings_factor', 1.0)
+    baseline = dict(NO_BATTERY, **financial.get('baseline', dict()))
+    agg = representative_days(model_data, k, periods_per_day)
+
+    records = dict()
+    position = tuple(len(a)//2 for a in axes) if start is None else tuple(axes[j].index(start[n]) for j, n in enumerate(names))
+    step = [max(1, len(a)//4) for a in axes]
+    counts = {'full': 0, 'screen': 0}
+
+
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(model_data, agg, solver, builder)) as pool:
+
+        base_full, base_screen = pool.map(_evaluate, [('full', baseline), ('screen', baseline)])
+        best = None
+
+        while True:
+
+            # Current position and its neighbours along every axis
+            candidates = [position]
+            for j in range(len(axes)):
+                for direction in (-1, 1):
+                    i = position[j] + direction*step[j]
+                    if 0 <= i < len(axes[j]):
+                        candidates.append(position[:j] + (i,) + position[j+1:])
+            new = [c for c in dict.fromkeys(candidates) if c not in records]
+
+
+            # Screening on the representative days
+            screen = list(pool.map(_evaluate, [('screen', overrides(c)) for c in new]))
+            counts['screen'] += len(new)
+            for c, cost in zip(new, screen):
+                o = overrides(c)
+                records[c] = dict(o, invest_cost=invest(o), screen_savings=(base_screen - cost)*factor,
+                                  savings=np.nan, npv=np.nan, status='pruned')
+
+            # Full solves of the candidates that may beat the best NPV
+            errors = [abs(r['screen_savings'] - r['savings'])/(abs(base_full)*factor)
+                      for r in records.values() if r['status'] == 'full']
+            m = max([margin] + [2*e for e in errors])
+            optimistic = npv([records[c]['invest_cost'] for c in new],
+                             [records[c]['screen_savings'] + m*abs(base_full)*factor for c in new])
+            full = [c for c, o in zip(new, optimistic) if best is None or o >= records[best]['npv'] or c == position]
+
+            costs = list(pool.map(_evaluate, [('full', overrides(c)) for c in full]))
+            counts['full'] += len(full)
+            for c, cost in zip(full, costs):
+                records[c].update(savings=(base_full - cost)*factor, status='full')
+            if full:
+                values = npv([records[c]['invest_cost'] for c in full], [records[c]['savings'] for c in full])
+                for c, v in zip(full, values):
+                    records[c]['npv'] = float(v)
+
+            if progress:
+                progress(len(records), records[position])
+
+
+            # Move to the best candidate, or refine the steps
+            evaluated = [c for c in candidates if records[c]['status'] == 'full']
+            top = max(evaluated, key=lambda c: records[c]['npv'])
+            if best is None or records[top]['npv'] > records[best]['npv']:
+                best = top
+            if best != position:
+                position = best
+            elif max(step) > 1:
+                step = [max(1, s//2) for s in step]
+            else:
+                break
+
+
+    df = pd.DataFrame(list(records.values()))
+    solved = df[df['status'] == 'full']
+
+    return {'best': records[best], 'evaluations': df, 'pareto': pareto_front(solved),
+            'full_solves': counts['full'], 'screen_solves': counts['screen'],
+            'baseline_cost': base_full, 'grid_size': int(np.prod([len(a) for a in axes]))}
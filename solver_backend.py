@@ -0,0 +1,330 @@
+import json
+import os
+import time
+import warnings
+from pyomo.common.collections import ComponentMap
+from pyomo.core import Suffix
+from pyomo.core import value
+import numpy as np
+
+from instrumentation import timed_phase, instrumented_solve
+from matrix_model import lp_arrays, lp_constraints
+
+
+
+# Solver backend of solve_model.
+#
+# A solve configuration is a dict
+#   {'name': 'highs', 'threads': 4, 'time_limit': 60, 'mip_gap': 1e-4,
+#    'fallback': ['appsi_highs', 'glpk', 'cbc'], 'options': {...}}
+#   name       'highs' compiles the model into sparse matrices (Pyomo's
+#              LinearStandardFormCompiler, needs scipy) and passes them to
+#              highspy in process, without any file; models of the matrix
+#              builder are passed as their CSR arrays, without compiling.
+#              Other names go through Pyomo's SolverFactory ('appsi_highs',
+#              'glpk', 'cbc', ...)
+#   path       executable of a file-based solver
+#   threads, time_limit [s], mip_gap (relative)
+#              translated to the option names of each solver (OPTION_NAMES)
+#   options    solver-specific options, passed as they are
+#   fallback   solvers (names or configurations) tried in order when the
+#              solver is not installed; they inherit the common settings
+#
+# In-process HiGHS loads a solution short of the optimum (e.g. time_limit
+# reached with a feasible point) with a RuntimeWarning and raises a
+# RuntimeError when it has no feasible point.
+#
+# default_solver() reads the configuration from the JSON file named by the
+# MICROGRID_SOLVER_CONFIG environment variable, else DEFAULT_SOLVER, so that
+# scripts do not hard-code a solver.
+#
+# Example
+# solve_model(model_instance, default_solver())
+# solve_model(model_instance, {'name': 'highs', 'threads': 4, 'time_limit': 30, 'fallback': ['glpk']})
+
+
+DEFAULT_SOLVER = {'name': 'highs', 'fallback': ['appsi_highs', 'glpk', 'cbc']}
+
+SOLVER_CONFIG_ENV = 'MICROGRID_SOLVER_CONFIG'
+
+# Common settings -> option name of every solver
+OPTION_NAMES = {'highs': {'threads': 'threads', 'time_limit': 'time_limit', 'mip_gap': 'mip_rel_gap'},
+                'appsi_highs': {'threads': 'threads', 'time_limit': 'time_limit', 'mip_gap': 'mip_rel_gap'},
+                'glpk': {'time_limit': 'tmlim', 'mip_gap': 'mipgap'},
+                'cbc': {'threads': 'threads', 'time_limit': 'sec', 'mip_gap': 'ratio'}}
+
+COMMON_SETTINGS = ['threads', 'time_limit', 'mip_gap']
+
+
+
+def default_solver():
+
+    path = os.environ.get(SOLVER_CONFIG_ENV)
+    if path:
+        with open(path) as f:
+            return json.load(f)
+
+    return dict(DEFAULT_SOLVER)
+
+
+def solver_available(solver):
+
+    if solver['name'] == 'highs':
+        try:
+            import highspy
+            import scipy
+            from pyomo.repn.plugins.standard_form import LinearStandardFormCompiler
+        except ImportError:
+            return False
+        return True
+
+    if 'path' in solver and not os.access(solver['path'], os.X_OK):
+        return False
+
+    return bool(_solver_factory(solver).available(exception_flag=False))
+
+
+def _solver_factory(solver):
+
+    # pyomo.environ registers the solver plugins, it is only loaded for SolverFactory solvers
+    import pyomo.environ
+    from pyomo.opt import SolverFactory
+
+    if 'path' in solver:
+        return SolverFactory(solver['name'], executable=solver['path'])
+    return SolverFactory(solver['name'])
+
+
+def select_solver(solver):
+
+    # First available of the solver and its fallbacks, fallbacks inherit the common settings
+    common = {k: solver[k] for k in COMMON_SETTINGS if k in solver}
+    candidates = [solver] + [dict(common, **({'name': f} if isinstance(f, str) else f)) for f in solver.get('fallback', [])]
+
+    for candidate in candidates:
+        if solver_available(candidate):
+            return candidate
+
+    raise RuntimeError("No solver available, tried %s" % [c['name'] for c in candidates])
+
+
+def solver_options(solver):
+
+    # Common settings under the solver's own option names, then the solver-specific options
+    names = OPTION_NAMES.get(solver['name'], dict())
+    options = dict()
+    for setting in COMMON_SETTINGS:
+        if setting in solver:
+            if setting not in names:
+                raise ValueError("Solver '%s' has no %s setting" % (solver['name'], setting))
+            options[names[setting]] = solver[setting]
+    options.update(solver.get('options', dict()))
+
+    return options
+
+
+
+def run_solver(model_instance, solver, tee=True, events=None):
+
+    # Returns the configuration of the solver that was used
+    solver = select_solver(solver)
+    options = solver_options(solver)
+
+    if solver['name'] == 'highs':
+        _solve_highs(model_instance, options, tee, events)
+        return solver
+
+    # Other solvers read the Pyomo rows, also for models of the matrix builder
+    lp_constraints(model_instance)
+    optimizer = _solver_factory(solver)
+
+    # Persistent HiGHS keeps its options apart, file-based solvers pass them on the command line
+    if hasattr(optimizer, 'highs_options'):
+        optimizer.highs_options.update(options)
+    else:
+        optimizer.options.update(options)
+
+    # events: callable receiving structured timing and status events (see instrumentation.py)
+    if events is None:
+        optimizer.solve(model_instance, tee=tee, keepfiles=False)
+    else:
+        instrumented_solve(optimizer, model_instance, events, solver['name'], tee=tee, keepfiles=False)
+
+    return solver
+
+
+
+def _highs_lp(repn):
+
+    import highspy
+
+    inf = highspy.kHighsInf
+    A = repn.A.tocsc()
+    n_rows, n_cols = A.shape
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = n_cols
+    lp.num_row_ = n_rows
+    lp.col_cost_ = repn.c.toarray()[0] if len(repn.objectives) else np.zeros(n_cols)
+    lp.offset_ = float(repn.c_offset[0]) if len(repn.objectives) else 0.0
+
+    bounds = [v.bounds for v in repn.columns]
+    lp.col_lower_ = np.array([-inf if lo is None else lo for lo, up in bounds], dtype=float)
+    lp.col_upper_ = np.array([inf if up is None else up for lo, up in bounds], dtype=float)
+
+    # Mixed form rows: bound type 0 is body == rhs, 1 is body <= rhs, -1 is body >= rhs
+    rhs = np.asarray(repn.rhs, dtype=float)
+    bound_type = np.array([row.bound_type for row in repn.rows], dtype=int)
+    lp.row_lower_ = np.where(bound_type == 1, -inf, rhs)
+    lp.row_upper_ = np.where(bound_type == -1, inf, rhs)
+
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = A.indptr
+    lp.a_matrix_.index_ = A.indices
+    lp.a_matrix_.value_ = A.data
+
+    integer = np.array([v.is_integer() or v.is_binary() for v in repn.columns], dtype=bool)
+    if integer.any():
+        lp.integrality_ = [highspy.HighsVarType.kInteger if i else highspy.HighsVarType.kContinuous for i in integer]
+
+    return lp
+
+
+def _solve_highs(model_instance, options, tee, events):
+
+
+    import highspy
+
+    phases = dict()
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    # Models of the matrix builder are passed as they are, others are compiled first
+    with timed_phase('write', events, solver='highs') as event:
+        lp = lp_arrays(model_instance)
+        if lp is None:
+            from pyomo.repn.plugins.standard_form import LinearStandardFormCompiler
+            lp_constraints(model_instance)
+            repn = LinearStandardFormCompiler().write(model_instance, mixed_form=True)
+            highs_lp, shape = _highs_lp(repn), repn.A.shape
+        else:
+            repn = None
+            highs_lp, rows, cols = _highs_csr(lp)
+            shape = (lp['n_rows'], lp['n_cols'])
+        highs = highspy.Highs()
+        highs.setOptionValue('output_flag', bool(tee))
+        for option, val in options.items():
+            highs.setOptionValue(option, val)
+        highs.passModel(highs_lp)
+    phases['write'] = event['wall_s']
+
+    with timed_phase('solve', events, solver='highs') as event:
+        highs.run()
+    phases['solve'] = event['wall_s']
+
+    # As with Pyomo's solvers: a point short of the optimum (time or iteration limit)
+    # is loaded with a warning, no feasible point is an error
+    status = highs.getModelStatus()
+    solution = highs.getSolution()
+    if status != highspy.HighsModelStatus.kOptimal:
+        feasible = highs.getInfo().primal_solution_status == highspy.SolutionStatus.kSolutionStatusFeasible
+        if not (solution.value_valid and feasible):
+            raise RuntimeError("HiGHS found no feasible solution: %s" % highs.modelStatusToString(status))
+        warnings.warn("HiGHS stopped before the optimum (%s), loading its best feasible solution"
+                      % highs.modelStatusToString(status), RuntimeWarning)
+
+    with timed_phase('load', events, solver='highs') as event:
+        if repn is None:
+            _load_highs_csr(model_instance, solution, rows, cols)
+        else:
+            _load_highs_solution(model_instance, repn, solution)
+    phases['load'] = event['wall_s']
+
+
+    if events is not None:
+        optimal = status == highspy.HighsModelStatus.kOptimal
+        info = highs.getInfo()
+        events({'event': 'solve', 'solver': 'highs',
+                'status': 'ok' if optimal else 'warning',
+                'termination_condition': 'optimal' if optimal else highs.modelStatusToString(status),
+                'iterations': info.simplex_iteration_count + info.ipm_iteration_count,
+                'rows': shape[0], 'cols': shape[1], 'nonzeros': len(highs_lp.a_matrix_.value_),
+                'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu, 'phases': phases})
+
+
+def _load_highs_solution(model_instance, repn, solution):
+
+    for v, x in zip(repn.columns, solution.col_value):
+        v.set_value(x, skip_validation=True)
+    for v, expr in repn.eliminated_vars:
+        v.set_value(value(expr), skip_validation=True)
+
+    _load_duals(model_instance, [row.constraint for row in repn.rows], repn.columns, solution)
+
+
+def _highs_csr(lp):
+
+    # The row-wise LP of the matrix builder (see matrix_model.py). Its columns are grouped
+    # by family; rows and columns are passed in a banded order instead (reverse
+    # Cuthill-McKee on the row-column graph), on which the simplex takes up to half the time.
+    # Returns the HiGHS LP and the LP row and column of every HiGHS row and column.
+    import highspy
+    import scipy.sparse as sp
+    from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+    m = lp['n_rows']
+    A = sp.csr_matrix((lp['data'], lp['indices'], lp['indptr']), shape=(m, lp['n_cols']))
+    order = reverse_cuthill_mckee(sp.bmat([[None, A], [A.T, None]], format='csr'), symmetric_mode=True)
+    rows, cols = order[order < m], order[order >= m] - m
+    A = A[rows][:, cols]
+
+    h = highspy.HighsLp()
+    h.num_col_ = lp['n_cols']
+    h.num_row_ = m
+    h.col_cost_ = lp['c'][cols]
+    h.offset_ = float(lp['c0'])
+    h.col_lower_ = lp['col_lo'][cols]
+    h.col_upper_ = lp['col_up'][cols]
+    h.row_lower_ = lp['row_lo'][rows]
+    h.row_upper_ = lp['row_up'][rows]
+
+    h.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    h.a_matrix_.start_ = A.indptr
+    h.a_matrix_.index_ = A.indices
+    h.a_matrix_.value_ = A.data
+
+    return h, rows, cols
+
+
+def _load_highs_csr(model_instance, solution, rows, cols):
+
+    columns = [model_instance._lp_columns[j] for j in cols]
+    for v, x in zip(columns, solution.col_value):
+        v.set_value(x, skip_validation=True)
+
+    # The rows only exist as Pyomo constraints for the duals. Fixed columns get no
+    # reduced cost, as in the compiled models where they are constants
+    if _dual_suffixes(model_instance):
+        lp_rows = lp_constraints(model_instance)._lp_rows
+        _load_duals(model_instance, [lp_rows[k] for k in rows], [None if v.fixed else v for v in columns], solution)
+
+
+def _dual_suffixes(model_instance):
+    return [name for name in ('dual', 'rc') if isinstance(model_instance.component(name), Suffix)
+            and model_instance.component(name).import_enabled()]
+
+
+def _load_duals(model_instance, rows, columns, solution):
+
+    # Duals and reduced costs into the import Suffixes model.dual / model.rc, if declared.
+    # A ranged row is two rows of the mixed form, at most one of them has a dual
+    if not solution.dual_valid:
+        return
+    for name in _dual_suffixes(model_instance):
+        items, values = (rows, solution.row_dual) if name == 'dual' else (columns, solution.col_dual)
+        total = ComponentMap()
+        for item, v in zip(items, values):
+            if item is not None:
+                total[item] = total.get(item, 0.0) + v
+        suffix = model_instance.component(name)
+        suffix.clear()
+        suffix.update(total)
@@ -0,0 +1,222 @@
+from pyomo.core import Constraint
+from pyomo.core import value
+from itertools import takewhile
+
+from solver_backend import solver_options
+
+
+
+# Reusable solver session for repeated what-if solves on the same horizon.
+#
+# The model is built once with mutable Params (microgrid_model(..., mutable=True)
+# or netmetering_model(..., mutable=True)) and loaded once into a persistent
+# in-process solver, with the settings of the solve configuration (threads,
+# time_limit, mip_gap and options, see solver_backend.py). update() sets the
+# Params and refreshes every Param-dependent coefficient in the solver (the
+# structure is never rebuilt); the next solve() starts from the basis of the
+# previous one.
+#
+# update_periods() only refreshes the rows of the changed periods and the
+# objective. appsi has no public call for that, so this uses the coefficient
+# helpers of appsi_highs (_mutable_helpers, _objective_helpers) and falls back
+# to a full refresh when a solver or Pyomo version does not have them.
+#
+# Example
+# model_instance = microgrid_model(model_data, mutable=True)
+# session = SolverSession(model_instance, {'name': 'appsi_highs'})
+# session.solve()
+# for capacity in [50, 100, 150]:
+#     session.update(battery_capacity=capacity)
+#     s = microgrid_results(session.solve())
+#
+# Intraday re-dispatch: at period t the decisions before t are realized and
+# only the forecasts of the next hours change
+# session.fix_past(t, realized={'BEL': {t-1: measured_soc}})   # drops the balance rows before t
+# session.update_periods(t, generation=pv_forecast, demand=load_forecast)
+# s = microgrid_results(session.solve())
+
+
+
+# Battery decisions fixed by fix_past; grid exchange follows from the energy balance
+PAST_DECISIONS = ['B_IN', 'B_OUT', 'BEL']
+
+
+
+class SolverSession:
+
+    def __init__(self, model_instance, solver=None, tee=False):
+
+        # pyomo.environ registers the solver plugins, it is only loaded when a session is opened
+        import pyomo.environ
+        from pyomo.opt import SolverFactory
+
+        solver = solver or {'name': 'appsi_highs'}
+        self.model = model_instance
+        self.tee = tee
+        self.optimizer = SolverFactory(solver['name'])
+
+        if not (self.optimizer.is_persistent() and hasattr(self.optimizer, 'update_params')):
+            raise ValueError("Solver '%s' has no persistent interface, use e.g. 'appsi_highs'" % solver['name'])
+
+        # Common settings under the solver's option names, as in solve_model
+        options = solver_options(solver)
+        if hasattr(self.optimizer, 'highs_options'):
+            self.optimizer.highs_options.update(options)
+        else:
+            self.optimizer.options.update(options)
+
+        # Structure never changes after the first solve, so nothing is checked before a solve;
+        # changes are pushed explicitly by update(), update_periods() and update_variables()
+        config = self.optimizer.update_config
+        config.check_for_new_or_removed_constraints = False
+        config.check_for_new_or_removed_vars = False
+        config.check_for_new_or_removed_params = False
+        config.check_for_new_objective = False
+        config.update_constraints = False
+        config.update_vars = False
+        config.update_params = False
+        config.update_named_expressions = False
+        config.update_objective = False
+        # Fixed variables become column bounds, so refixing BEL/P_CONTR does not touch any row
+        config.treat_fixed_vars_as_params = False
+
+        self.loaded = False
+        self.n_solves = 0
+        self._period_rows = None
+
+
+    def update(self, **params):
+
+        # Scalars are given as numbers, time series as lists/arrays over T or {period: value} dicts
+        for name, val in params.items():
+            param = getattr(self.model, name, None)
+            if param is None or param.ctype.__name__ != 'Param' or not param.mutable:
+                raise ValueError("'%s' is not a mutable Param of the model" % name)
+
+            if param.is_indexed():
+                if not isinstance(val, dict):
+                    val = dict(zip(param.index_set(), val))
+                param.store_values(val)
+            else:
+                param.set_value(val)
+
+        if self.loaded:
+            self.optimizer.update_params()
+            self.optimizer.update_variables(self._refix())
+
+
+    def update_periods(self, start, **series):
+
+        # New values for a range of periods of the time-series Params, e.g. an intraday forecast
+        # update_periods(t, generation=[...], demand=[...]) changes the periods t, t+1, ... only
+        periods = list(self.model.T)
+        first = periods.index(start)
+
+        for name, val in series.items():
+            param = getattr(self.model, name, None)
+            if param is None or param.ctype.__name__ != 'Param' or not param.mutable or not param.is_indexed():
+                raise ValueError("'%s' is not a mutable time-series Param of the model" % name)
+            if first + len(val) > len(periods):
+                raise ValueError("'%s' runs past the last period of the model" % name)
+            param.store_values(dict(zip(periods[first:first+len(val)], val)))
+
+        if self.loaded:
+            last = first + max(len(val) for val in series.values())
+            self._update_period_rows(periods[first:last])
+
+
+    def _update_period_rows(self, periods):
+
+        # appsi_highs keeps one coefficient helper per row with mutable Params; only the
+        # rows of the changed periods need them, instead of update_params() over the whole model
+        helpers = getattr(self.optimizer, '_mutable_helpers', None)
+        objective = getattr(self.optimizer, '_objective_helpers', None)
+        if helpers is None or objective is None:
+            self.optimizer.update_params()
+            return
+
+        if self._period_rows is None:
+            self._period_rows = {t: [] for t in self.model.T}
+            for con in self.model.component_objects(Constraint, active=True):
+                if con.is_indexed() and con.index_set() is self.model.T:
+                    for t, row in con.items():
+                        self._period_rows[t].append(row)
+
+        for t in periods:
+            for row in self._period_rows[t]:
+                for helper in helpers.get(row, ()):
+                    helper.update()
+        for helper in objective:
+            helper.update()
+
+
+    def fix_past(self, until, realized=None, variables=PAST_DECISIONS):
+
+        # Fix the decisions of all periods before `until` as realized: at the last solution,
+        # or at the measured values in realized = {variable name: {period: value}}.
+        # A measured soc need not follow from the planned charge and discharge, so the
+        # battery balance rows of these periods are dropped; the soc of the last of them
+        # is the initial state of the rest of the horizon
+        realized = realized or dict()
+        past = list(takewhile(lambda t: t != until, self.model.T))
+        changed = []
+        for t in past:
+            for name in variables:
+                var = getattr(self.model, name)[t]
+                val = realized.get(name, dict()).get(t, var.value)
+                if not (var.fixed and var.value == val):
+                    var.fix(val)
+                    changed.append(var)
+
+        # The solver drops variables left without rows, so the fixings go first
+        self.update_variables(changed)
+        rows = [self.model.battery_soc[t] for t in past if self.model.battery_soc[t].active]
+        for row in rows:
+            row.deactivate()
+        if self.loaded and rows:
+            self.optimizer.remove_constraints(rows)
+        self._period_rows = None
+
+        return len(changed)
+
+
+    def update_variables(self, variables):
+
+        # Push bound or fixed-value changes made directly on model variables
+        if self.loaded:
+            self.optimizer.update_variables(variables)
+
+
+    def _refix(self):
+
+        # Fixed values are derived from Params when the model is built
+        model = self.model
+        changed = []
+
+        last = model.BEL[model.T.last()]
+        if value(model.bel_fin_level) > 0:
+            last.fix(value(model.bel_fin_level*model.battery_capacity))
+        else:
+            last.unfix()
+        changed.append(last)
+
+        if hasattr(model, 'P_CONTR'):
+            if value(model.grid_power_contract) > 0:
+                model.P_CONTR.fix(value(model.grid_power_contract))
+            else:
+                model.P_CONTR.unfix()
+            changed.append(model.P_CONTR)
+
+        return changed
+
+
+    def solve(self):
+
+        if not self.loaded:
+            self.optimizer.set_instance(self.model)
+            self.loaded = True
+
+        self.results = self.optimizer.solve(self.model, tee=self.tee)
+        self.n_solves += 1
+
+        return self.model
@@ -0,0 +1,246 @@
+from concurrent.futures import ProcessPoolExecutor
+from pyomo.core import Var, Constraint, NonNegativeReals
+from pyomo.core import value
+import numpy as np
+
+from matrix_model import build_lp, stack_lp, lp_to_pyomo, lp_column, add_rows, add_terms
+from model_core import solve_model
+import tariff_contract
+
+
+
+# Two-stage stochastic microgrid_model over a PV / load forecast ensemble.
+#
+# The power contract P_CONTR (and, with battery_cost, the battery capacity
+# BATTERY_CAPACITY) is decided once for all scenarios; the dispatch, the grid
+# exchange and the overcharge are decided per scenario. The objective is the
+# expected cost over the scenarios plus the battery cost.
+#
+# The LP of one scenario is assembled with the matrix builder and repeated
+# over the scenario axis with stack_lp, only the energy balance right-hand
+# sides differ, so building does not loop over scenarios. Scenario variables and
+# constraints keep their names and are indexed by (S, T) (or S for scalars).
+# The Pyomo model holds the variables and the objective; in-process HiGHS
+# ('highs') takes the stacked CSR arrays as they are (see matrix_model.py). For
+# large ensembles the solve itself dominates, HiGHS's interior point method
+# ({'name': 'highs', 'options': {'solver': 'ipm'}}) takes about half the time
+# of the simplex there.
+#
+# progressive_hedging solves the scenarios separately in a process pool and
+# moves them to a common first-stage decision. The quadratic proximal term is
+# replaced by tangent cuts so that every subproblem stays an LP.
+#
+# Example
+# model_data = microgrid_data_input(data)
+# model_instance = stochastic_model(model_data, generation_ensemble, demand_ensemble)
+# solve_model(model_instance, solver)
+# s = stochastic_results(model_instance)
+# ph = progressive_hedging(model_data, generation_ensemble, demand_ensemble, solver, max_workers=8)
+
+
+# Points of the tangent cuts of the proximal term, in multiples of the scenario spread
+TANGENT_POINTS = np.array([-2.0, -1.0, -0.5, -0.25, 0.0, 0.25, 0.5, 1.0, 2.0])
+
+# Default PH penalty, in multiples of the first-stage unit costs (grid_fee_power, battery_cost)
+RHO_FACTOR = 10.0
+
+
+
+def _battery_sizing(battery_cost, capacity_max):
+
+    # BATTERY_CAPACITY in [0, capacity_max] replaces battery_capacity in the soc limits
+    # and in the initial / final soc; battery_cost [EUR/kWh] is charged once
+    def extend(lp, model_data):
+
+        d = model_data[None]
+        CAP, BEL = lp_column(lp, 'BATTERY_CAPACITY'), lp_column(lp, 'BEL')
+
+        lp['col_lo'][CAP], lp['col_up'][CAP] = 0.0, capacity_max
+        lp['c'][CAP] = battery_cost
+        lp['col_lo'][BEL], lp['col_up'][BEL] = 0.0, np.inf
+        lp['fixed'][BEL] = False
+
+        add_rows(lp, 'battery_capacity_max', 'T', [(BEL, 1.0), (CAP, -1.0)], -np.inf, 0.0)
+        if d['battery_min_level'] > 0:
+            add_rows(lp, 'battery_capacity_min', 'T', [(BEL, 1.0), (CAP, -d['battery_min_level'])], 0.0, np.inf)
+
+        initial = np.zeros(len(BEL))
+        initial[0] = -d['bel_ini_level']
+        add_terms(lp, 'battery_soc', [(CAP, initial)])
+
+        if d['bel_fin_level'] > 0:
+            add_rows(lp, 'battery_final_soc', None, [(BEL[-1:], 1.0), (CAP, -d['bel_fin_level'])], 0.0, 0.0)
+
+    return extend
+
+
+def stochastic_lp(model_data, generation, demand, probabilities=None, battery_cost=None):
+
+
+    # generation, demand: (scenarios, periods) arrays; probabilities default to equal
+    d = model_data[None]
+    generation = np.atleast_2d(np.asarray(generation, dtype=float))
+    demand = np.broadcast_to(np.asarray(demand, dtype=float), generation.shape)
+    n_scenarios, n = generation.shape
+    if n != len(d['T']):
+        raise ValueError("The scenarios must have one value for each of the %d periods, got %d" % (len(d['T']), n))
+
+    if probabilities is None:
+        probabilities = np.full(n_scenarios, 1.0/n_scenarios)
+    probabilities = np.asarray(probabilities, dtype=float)
+    if len(probabilities) != n_scenarios or np.any(probabilities < 0) or abs(probabilities.sum() - 1) > 1e-9:
+        raise ValueError("probabilities must be one non-negative value per scenario summing to 1")
+
+
+    shared = ['P_CONTR']
+    if battery_cost is None:
+        lp = build_lp(model_data, tariff_contract)
+    else:
+        if d['battery_capacity'] <= 0:
+            raise ValueError("With battery_cost, battery_capacity is the largest capacity and must be > 0")
+        base = {None: dict(d, battery_capacity=0)}
+        lp = build_lp(base, tariff_contract, [('BATTERY_CAPACITY', None)], _battery_sizing(battery_cost, d['battery_capacity']))
+        shared.append('BATTERY_CAPACITY')
+
+    lp = stack_lp(lp, probabilities, shared)
+
+
+    # Scenario right-hand sides
+    rows = lp['rows']['energy_balance'][1].reshape(n_scenarios, n)
+    lp['row_lo'][rows] = generation - demand
+    lp['row_up'][rows] = generation - demand
+    if 'no_grid_charging' in lp['rows']:
+        lp['row_up'][lp['rows']['no_grid_charging'][1].reshape(n_scenarios, n)] = demand
+
+    return lp
+
+
+def stochastic_model(model_data, generation, demand, probabilities=None, battery_cost=None):
+
+    # battery_cost [EUR/kWh over the horizon]: the battery capacity becomes a first-stage
+    # decision up to battery_capacity of model_data
+    return lp_to_pyomo(stochastic_lp(model_data, generation, demand, probabilities, battery_cost))
+
+
+
+def _block(solution, var):
+    S, T = list(solution.S), list(solution.T)
+    return np.array([var[s, t].value for s in S for t in T], dtype=float).reshape(len(S), len(T))
+
+
+def stochastic_results(solution):
+
+
+    S = list(solution.S)
+
+    s = dict()
+    s['power_contract'] = value(solution.P_CONTR)
+    if hasattr(solution, 'BATTERY_CAPACITY'):
+        s['battery_capacity'] = value(solution.BATTERY_CAPACITY)
+    s['expected_cost'] = value(solution.total_cost)
+
+    # Cost of every scenario without the battery cost
+    s['scenario_cost'] = (_block(solution, solution.COST_ENERGY).sum(axis=1) + _block(solution, solution.COST_GRID_ENERGY).sum(axis=1)
+                          + np.array([value(solution.COST_GRID_POWER[i]) for i in S])).tolist()
+    s['power_overcharge'] = [value(solution.P_OVER[i]) for i in S]
+
+    # (scenarios x periods)
+    s['power_buy'] = _block(solution, solution.P_BUY).tolist()
+    s['power_sell'] = _block(solution, solution.P_SELL).tolist()
+    s['battery_soc'] = _block(solution, solution.BEL).tolist()
+    s['battery_charge'] = _block(solution, solution.B_IN).tolist()
+    s['battery_discharge'] = _block(solution, solution.B_OUT).tolist()
+
+    return s
+
+
+
+def _solve_scenario(model_data, generation, demand, battery_cost, solver, W=None, xbar=None, rho=None, spread=None, fixed=None):
+
+    # One scenario with the first stage fixed, or with the PH terms W x + prox(x - xbar)
+    model_instance = stochastic_model(model_data, generation[None, :], demand[None, :], None, battery_cost)
+    m = model_instance
+    x = [m.P_CONTR] + ([m.BATTERY_CAPACITY] if battery_cost is not None else [])
+    cost = m.total_cost.expr
+
+    if fixed is not None:
+        for v, val in zip(x, fixed):
+            v.fix(val)
+    elif W is not None:
+        # Tangents of rho/2 (x - xbar)^2 at xbar + spread*TANGENT_POINTS, the outer ones
+        # steeper than W so that the subproblem stays bounded
+        m.PH_PROX = Var(range(len(x)), within=NonNegativeReals)
+        cuts = []
+        for j in range(len(x)):
+            outer = 2*(spread[j] + (abs(W[j])/rho[j] if rho[j] > 0 else 0.0))
+            cuts += [(j, xbar[j] + k) for k in np.concatenate((spread[j]*TANGENT_POINTS, [-outer, outer]))]
+        def prox(m, i):
+            j, p = cuts[i]
+            return m.PH_PROX[j] >= rho[j]/2*(p - xbar[j])**2 + rho[j]*(p - xbar[j])*(x[j] - p)
+        m.PH_PROX_CUTS = Constraint(range(len(cuts)), rule=prox)
+        m.total_cost.set_value(cost + sum(W[j]*x[j] + m.PH_PROX[j] for j in range(len(x))))
+
+    solve_model(model_instance, solver, tee=False)
+
+    return {'x': [value(v) for v in x], 'cost': value(cost)}
+
+
+def progressive_hedging(model_data, generation, demand, solver, probabilities=None, battery_cost=None,
+                        rho=None, iterations=100, tol=1e-4, max_workers=None):
+
+
+    d = model_data[None]
+    generation = np.atleast_2d(np.asarray(generation, dtype=float))
+    demand = np.broadcast_to(np.asarray(demand, dtype=float), generation.shape)
+    n_scenarios = len(generation)
+    p = np.full(n_scenarios, 1.0/n_scenarios) if probabilities is None else np.asarray(probabilities, dtype=float)
+    if d['grid_power_contract'] > 0:
+        raise ValueError("progressive_hedging optimizes the power contract, grid_power_contract must be 0")
+
+    def solve_all(pool, **kwds):
+        args = [kwds.get(k, [None]*n_scenarios) for k in ('W', 'xbar', 'rho', 'spread', 'fixed')]
+        return list(pool.map(_solve_scenario, [model_data]*n_scenarios, generation, demand, [battery_cost]*n_scenarios,
+                             [solver]*n_scenarios, *args))
+
+    with ProcessPoolExecutor(max_workers) as pool:
+
+        # Iteration 0: every scenario on its own
+        r = solve_all(pool)
+        x = np.array([ri['x'] for ri in r])
+        xbar = p @ x
+
+        # Cost-proportional rho: RHO_FACTOR times the unit cost of every first-stage decision
+        if rho is None:
+            rho = RHO_FACTOR*np.array([d['grid_fee_power']] + ([battery_cost] if battery_cost is not None else []))
+        rho = np.broadcast_to(np.asarray(rho, dtype=float), xbar.shape)
+        W = rho*(x - xbar)
+
+        residual = [float(p @ np.abs(x - xbar).sum(axis=1))]
+        k = 0
+        while residual[-1] > tol*(1 + np.abs(xbar).sum()) and k < iterations:
+            k += 1
+            spread = np.maximum(np.abs(x - xbar).max(axis=0), 1e-3*(1 + np.abs(xbar)))
+            r = solve_all(pool, W=list(W), xbar=[xbar]*n_scenarios, rho=[rho]*n_scenarios, spread=[spread]*n_scenarios)
+            x = np.array([ri['x'] for ri in r])
+            xbar = p @ x
+            W = W + rho*(x - xbar)
+            residual.append(float(p @ np.abs(x - xbar).sum(axis=1)))
+
+        # Recourse of every scenario for the common first-stage decision
+        r = solve_all(pool, fixed=[xbar]*n_scenarios)
+
+
+    # As in stochastic_results, the scenario costs are without the battery cost
+    battery = battery_cost*xbar[1] if battery_cost is not None else 0.0
+
+    s = dict()
+    s['power_contract'] = float(xbar[0])
+    if battery_cost is not None:
+        s['battery_capacity'] = float(xbar[1])
+    s['scenario_cost'] = [ri['cost'] - battery for ri in r]
+    s['expected_cost'] = float(p @ np.array(s['scenario_cost']) + battery)
+    s['iterations'] = k
+    s['converged'] = residual[-1] <= tol*(1 + np.abs(xbar).sum())
+    s['residual'] = residual
+
+    return s
@@ -0,0 +1,156 @@
+from pyomo.core import Param,Var,Constraint
+from pyomo.core import NonNegativeReals
+from pyomo.core import value
+import numpy as np
+
+from matrix_model import lp_column, add_rows, fix_column
+from model_core import dual_marginal
+
+
+
+# Flat power contract tariff (microgrid_model), plugged into model_core.py.
+#
+# An energy fee on the energy bought and sold, a fee on the contracted power
+# P_CONTR and a penalty on the largest exchange above the contract P_OVER.
+# grid_power_contract > 0 fixes the contract, 0 lets the model optimize it.
+
+
+SERIES = dict()
+INTEGER_SERIES = []
+SCALARS = {'grid_fee_energy': None, 'grid_fee_power': None, 'grid_overcharge_penalty': 0, 'grid_power_contract': 0}
+
+COLUMNS = [('COST_GRID_ENERGY', 'T'), ('COST_GRID_POWER', None), ('P_CONTR', None), ('P_OVER', None)]
+
+
+
+def tariff_rules(model, model_data, mutable=False):
+
+
+    ## PARAMETERS
+    model.grid_fee_energy               = Param(initialize=model_data[None]['grid_fee_energy'], mutable=mutable)
+    model.grid_fee_power                = Param(initialize=model_data[None]['grid_fee_power'], mutable=mutable)
+    model.grid_overcharge_penalty       = Param(initialize=model_data[None]['grid_overcharge_penalty'], mutable=mutable)
+    model.grid_power_contract           = Param(initialize=model_data[None]['grid_power_contract'], mutable=mutable)
+
+
+    ## VARIABLES
+    model.COST_GRID_ENERGY  = Var(model.T)
+    model.COST_GRID_POWER   = Var()
+    model.P_CONTR           = Var(within=NonNegativeReals)
+    model.P_OVER            = Var(within=NonNegativeReals)
+
+
+    ## CONSTRAINTS
+    # Grid energy cost
+    def grid_energy_cost(model, t):
+        return model.COST_GRID_ENERGY[t] == model.grid_fee_energy*(model.P_BUY[t]+model.P_SELL[t])*model.dt
+    model.grid_energy_cost = Constraint(model.T, rule=grid_energy_cost)
+
+    # Grid power cost
+    def grid_power_cost(model):
+        return model.COST_GRID_POWER == model.grid_fee_power*model.P_CONTR + model.grid_overcharge_penalty*model.P_OVER
+    model.grid_power_cost = Constraint(rule=grid_power_cost)
+
+
+    # Overcharge
+    def overcharge_import(model, t):
+        return model.P_OVER >= model.P_BUY[t] - model.P_CONTR
+    model.overcharge_import = Constraint(model.T, rule=overcharge_import)
+
+    def overcharge_export(model, t):
+        return model.P_OVER >= model.P_SELL[t] - model.P_CONTR
+    model.overcharge_export = Constraint(model.T, rule=overcharge_export)
+
+
+    # Fix power contract (if 0 then power contract level is optimized)
+    if value(model.grid_power_contract) > 0:
+        model.P_CONTR.fix(value(model.grid_power_contract))
+
+
+def tariff_cost(model):
+    return sum(model.COST_GRID_ENERGY[t] for t in model.T) + model.COST_GRID_POWER
+
+
+
+def tariff_sets(model_data):
+    return dict()
+
+
+def tariff_lp(lp, model_data):
+
+
+    d = model_data[None]
+    dt = d['dt']
+
+    CGE, CGP = lp_column(lp, 'COST_GRID_ENERGY'), lp_column(lp, 'COST_GRID_POWER')
+    PC, PO = lp_column(lp, 'P_CONTR'), lp_column(lp, 'P_OVER')
+    PB, PS = lp_column(lp, 'P_BUY'), lp_column(lp, 'P_SELL')
+
+
+    ## VARIABLE LIMITS
+    lp['col_lo'][PC] = 0.0
+    lp['col_lo'][PO] = 0.0
+
+
+    ## OBJECTIVE
+    lp['c'][CGE] = 1.0
+    lp['c'][CGP] = 1.0
+
+
+    ## CONSTRAINTS
+    # Grid energy cost
+    add_rows(lp, 'grid_energy_cost', 'T',
+             [(CGE, 1.0), (PB, -d['grid_fee_energy']*dt), (PS, -d['grid_fee_energy']*dt)], 0.0, 0.0)
+
+    # Grid power cost
+    add_rows(lp, 'grid_power_cost', None,
+             [(CGP, 1.0), (PC, -d['grid_fee_power']), (PO, -d['grid_overcharge_penalty'])], 0.0, 0.0)
+
+    # Overcharge
+    add_rows(lp, 'overcharge_import', 'T', [(PO, 1.0), (PB, -1.0), (PC, 1.0)], 0.0, np.inf)
+    add_rows(lp, 'overcharge_export', 'T', [(PO, 1.0), (PS, -1.0), (PC, 1.0)], 0.0, np.inf)
+
+    # Fix power contract (if 0 then power contract level is optimized)
+    if d['grid_power_contract'] > 0:
+        fix_column(lp, PC[0], d['grid_power_contract'])
+
+
+
+def tariff_results(solution, s):
+
+    s['cost_grid_energy'] = value(solution.COST_GRID_ENERGY[:])
+    s['cost_grid_power'] = value(solution.COST_GRID_POWER)
+    s['power_overcharge'] = value(solution.P_OVER)
+    s['power_contract'] = value(solution.P_CONTR)
+
+
+def tariff_sensitivities(solution, s):
+
+    # [EUR/kW] d total_cost / d grid_power_contract, for a fixed contract (0 when optimized)
+    s['marginal_power_contract'] = float(dual_marginal(solution, solution.P_CONTR, [solution.grid_power_cost],
+                                                       list(solution.overcharge_import.values()),
+                                                       list(solution.overcharge_export.values())))
+
+
+
+def tariff_analytic(model_data, p_buy, p_sell):
+
+    # Closed form for a given grid exchange, None for negative fees
+    d = model_data[None]
+    if min(d['grid_fee_energy'], d['grid_fee_power'], d['grid_overcharge_penalty']) < 0:
+        return None
+
+    # The contract covers the peak when it is cheaper than the overcharge penalty
+    peak = max(p_buy.max(initial=0.0), p_sell.max(initial=0.0))
+    contract = d['grid_power_contract']
+    if contract <= 0:
+        contract = peak if d['grid_fee_power'] <= d['grid_overcharge_penalty'] else 0.0
+    over = max(peak - contract, 0.0)
+
+    s = dict()
+    s['cost_grid_energy'] = (d['grid_fee_energy']*(p_buy + p_sell)*d['dt']).tolist()
+    s['cost_grid_power'] = d['grid_fee_power']*contract + d['grid_overcharge_penalty']*over
+    s['power_overcharge'] = over
+    s['power_contract'] = contract
+
+    return s
@@ -0,0 +1,281 @@
+from pyomo.core import Set,Param,Var,Constraint
+from pyomo.core import NonNegativeReals, Reals
+from pyomo.core import value
+import numpy as np
+
+from matrix_model import lp_series, lp_column, add_rows, fix_column
+from data_io import indexed
+
+
+
+# Swedish net-metering tariff (netmetering_model), plugged into model_core.py.
+#
+# A fixed monthly fee, energy fees on import and export per period and a power
+# fee on the highest import / export cost of every month (month_order gives
+# the month of every period).
+#
+# Fees are often zero most of the time (power fees only in high-load hours,
+# no export fees) and can be given as compact schedules (see
+# data_io.schedule_series). Periods with a zero fee get no Param entry and no
+# cost row, their cost variables are fixed to 0. Mutable models keep every row,
+# since a SolverSession may change any fee later.
+
+
+SERIES = {'grid_energy_import_fee': None, 'grid_energy_export_fee': None,
+          'grid_power_import_fee': None, 'grid_power_export_fee': None, 'month_order': None}
+INTEGER_SERIES = ['month_order']
+SCALARS = {'grid_fixed_fee': None, 'import_penalty': 0}
+
+COLUMNS = [('COST_GRID_ENERGY_IMPORT', 'T'), ('COST_GRID_ENERGY_EXPORT', 'T'),
+           ('COST_GRID_POWER_IMPORT', 'T'), ('COST_GRID_POWER_EXPORT', 'T'), ('COST_GRID_POWER', 'T'),
+           ('COST_GRID_POWER_MAX', 'M'), ('COST_GRID_FIXED', None)]
+
+
+
+def tariff_rules(model, model_data, mutable=False):
+
+
+    month_order = indexed(model_data[None]['month_order'], model_data[None]['T'])
+    zero = _zero_fees(model_data, mutable)
+
+    def fee(name):
+        # Zero fees are left to the Param default
+        return {t: v for t, v in indexed(model_data[None][name], model_data[None]['T']).items()
+                if v != 0 or mutable}
+
+    ## SETS
+    model.M = Set(dimen=1, ordered=True, initialize=np.array(list(set(month_order.values())))) # Months
+
+
+    ## PARAMETERS
+    model.grid_fixed_fee                = Param(initialize=model_data[None]['grid_fixed_fee'], mutable=mutable)
+    model.grid_energy_import_fee        = Param(model.T, within=Reals, initialize=fee('grid_energy_import_fee'), default=0.0, mutable=mutable)
+    model.grid_energy_export_fee        = Param(model.T, within=Reals, initialize=fee('grid_energy_export_fee'), default=0.0, mutable=mutable)
+
+    model.grid_power_import_fee         = Param(model.T, within=Reals, initialize=fee('grid_power_import_fee'), default=0.0, mutable=mutable)
+    model.grid_power_export_fee         = Param(model.T, within=Reals, initialize=fee('grid_power_export_fee'), default=0.0, mutable=mutable)
+
+    model.import_penalty                = Param(initialize=model_data[None]['import_penalty'], mutable=mutable)
+
+
+    ## VARIABLES
+    model.COST_GRID_ENERGY_IMPORT       = Var(model.T, within=Reals)
+    model.COST_GRID_ENERGY_EXPORT       = Var(model.T, within=Reals)
+    model.COST_GRID_POWER_IMPORT        = Var(model.T, within=NonNegativeReals)
+    model.COST_GRID_POWER_EXPORT        = Var(model.T, within=NonNegativeReals)
+    model.COST_GRID_POWER               = Var(model.T, within=Reals)
+    model.COST_GRID_POWER_MAX           = Var(model.M, within=Reals)
+    model.COST_GRID_FIXED               = Var(within=Reals)
+
+
+    ## CONSTRAINTS
+    # Grid fixed cost
+    def grid_fixed_cost(model):
+        return model.COST_GRID_FIXED == model.grid_fixed_fee*len(model.M)
+    model.grid_fixed_cost = Constraint(rule=grid_fixed_cost)
+
+
+
+    # Grid energy import cost
+    def grid_energy_import_cost(model, t):
+        if t in zero['grid_energy_import_fee']:
+            return Constraint.Skip
+        return model.COST_GRID_ENERGY_IMPORT[t] == model.grid_energy_import_fee[t]*model.P_BUY[t]*model.dt
+    model.grid_energy_import_cost = Constraint(model.T, rule=grid_energy_import_cost)
+
+    # Grid energy export cost
+    def grid_energy_export_cost(model, t):
+        if t in zero['grid_energy_export_fee']:
+            return Constraint.Skip
+        return model.COST_GRID_ENERGY_EXPORT[t] == model.grid_energy_export_fee[t]*model.P_SELL[t]*model.dt
+    model.grid_energy_export_cost = Constraint(model.T, rule=grid_energy_export_cost)
+
+
+
+    # Grid power import cost
+    def grid_power_import_cost(model, t):
+        if t in zero['grid_power_import_fee']:
+            return Constraint.Skip
+        return model.COST_GRID_POWER_IMPORT[t] >= model.grid_power_import_fee[t]*(model.P_BUY[t]-model.P_SELL[t])
+    model.grid_power_import_cost = Constraint(model.T, rule=grid_power_import_cost)
+
+    # Grid power export cost
+    def grid_power_export_cost(model, t):
+        if t in zero['grid_power_export_fee']:
+            return Constraint.Skip
+        return model.COST_GRID_POWER_EXPORT[t] >= model.grid_power_export_fee[t]*(model.P_SELL[t]-model.P_BUY[t])
+    model.grid_power_export_cost = Constraint(model.T, rule=grid_power_export_cost)
+
+
+    # Grid power cost
+    def grid_power_cost(model, t):
+        if t in zero['power']:
+            return Constraint.Skip
+        return model.COST_GRID_POWER[t] == model.COST_GRID_POWER_IMPORT[t] + model.COST_GRID_POWER_EXPORT[t]
+    model.grid_power_cost = Constraint(model.T, rule=grid_power_cost)
+
+
+    # Max grid cost
+    def max_grid_power_cost(model, t):
+        if t in zero['power']:
+            return Constraint.Skip
+        return model.COST_GRID_POWER_MAX[month_order[t]] >= model.COST_GRID_POWER[t]
+    model.max_grid_power_cost = Constraint(model.T, rule=max_grid_power_cost)
+
+
+    # Costs of the skipped rows are 0
+    for var, name in ((model.COST_GRID_ENERGY_IMPORT, 'grid_energy_import_fee'), (model.COST_GRID_ENERGY_EXPORT, 'grid_energy_export_fee'),
+                      (model.COST_GRID_POWER_IMPORT, 'grid_power_import_fee'), (model.COST_GRID_POWER_EXPORT, 'grid_power_export_fee'),
+                      (model.COST_GRID_POWER, 'power')):
+        for t in zero[name]:
+            var[t].fix(0.0)
+    for m in zero['months']:
+        model.COST_GRID_POWER_MAX[m].fix(0.0)
+
+
+def tariff_cost(model):
+    return sum(model.COST_GRID_ENERGY_IMPORT[t] + model.COST_GRID_ENERGY_EXPORT[t] for t in model.T) \
+        + sum(model.COST_GRID_POWER_MAX[m] for m in model.M) + model.COST_GRID_FIXED \
+        + model.import_penalty*sum(model.P_BUY[t]*model.dt for t in model.T)
+
+
+
+def _zero_fees(model_data, mutable=False):
+
+    # Periods (and months) whose cost rows can be skipped: {fee name: set of periods}
+    T = np.asarray(model_data[None]['T'])
+    names = ['grid_energy_import_fee', 'grid_energy_export_fee', 'grid_power_import_fee', 'grid_power_export_fee']
+    if mutable:
+        return dict({name: set() for name in names}, power=set(), months=set())
+
+    zero = {name: lp_series(model_data, name) == 0 for name in names}
+    power = zero['grid_power_import_fee'] & zero['grid_power_export_fee']
+    month_order = lp_series(model_data, 'month_order').astype(np.int64)
+
+    zero = {name: set(T[mask].tolist()) for name, mask in zero.items()}
+    zero['power'] = set(T[power].tolist())
+    zero['months'] = set(month_order.tolist()) - set(month_order[~power].tolist())
+
+    return zero
+
+
+def tariff_sets(model_data):
+    return {'M': np.array(list(set(lp_series(model_data, 'month_order').astype(np.int64))))}
+
+
+def tariff_lp(lp, model_data):
+
+
+    d = model_data[None]
+    dt = d['dt']
+
+    month_order = lp_series(model_data, 'month_order').astype(np.int64)
+    month_pos = {m: k for k, m in enumerate(lp['sets']['M'])}
+
+    grid_energy_import_fee = lp_series(model_data, 'grid_energy_import_fee')
+    grid_energy_export_fee = lp_series(model_data, 'grid_energy_export_fee')
+    grid_power_import_fee = lp_series(model_data, 'grid_power_import_fee')
+    grid_power_export_fee = lp_series(model_data, 'grid_power_export_fee')
+
+    CGEI, CGEE = lp_column(lp, 'COST_GRID_ENERGY_IMPORT'), lp_column(lp, 'COST_GRID_ENERGY_EXPORT')
+    CGPI, CGPE = lp_column(lp, 'COST_GRID_POWER_IMPORT'), lp_column(lp, 'COST_GRID_POWER_EXPORT')
+    CGP, CGPM, CGF = lp_column(lp, 'COST_GRID_POWER'), lp_column(lp, 'COST_GRID_POWER_MAX'), lp_column(lp, 'COST_GRID_FIXED')
+    PB, PS = lp_column(lp, 'P_BUY'), lp_column(lp, 'P_SELL')
+
+
+    ## VARIABLE LIMITS
+    lp['col_lo'][CGPI] = 0.0
+    lp['col_lo'][CGPE] = 0.0
+
+
+    ## OBJECTIVE
+    lp['c'][CGEI] = 1.0
+    lp['c'][CGEE] = 1.0
+    lp['c'][CGPM] = 1.0
+    lp['c'][CGF] = 1.0
+    lp['c'][PB] += d['import_penalty']*dt
+
+
+    ## CONSTRAINTS
+    # Grid fixed cost
+    add_rows(lp, 'grid_fixed_cost', None, [(CGF, 1.0)], d['grid_fixed_fee']*len(CGPM), d['grid_fixed_fee']*len(CGPM))
+
+    # Grid energy import / export cost, only where the fee is not zero
+    add_rows(lp, 'grid_energy_import_cost', 'T', [(CGEI, 1.0), (PB, -grid_energy_import_fee*dt)], 0.0, 0.0,
+             where=grid_energy_import_fee != 0)
+    add_rows(lp, 'grid_energy_export_cost', 'T', [(CGEE, 1.0), (PS, -grid_energy_export_fee*dt)], 0.0, 0.0,
+             where=grid_energy_export_fee != 0)
+
+    # Grid power import / export cost
+    add_rows(lp, 'grid_power_import_cost', 'T',
+             [(CGPI, 1.0), (PB, -grid_power_import_fee), (PS, grid_power_import_fee)], 0.0, np.inf,
+             where=grid_power_import_fee != 0)
+    add_rows(lp, 'grid_power_export_cost', 'T',
+             [(CGPE, 1.0), (PS, -grid_power_export_fee), (PB, grid_power_export_fee)], 0.0, np.inf,
+             where=grid_power_export_fee != 0)
+
+    # Grid power cost
+    power = (grid_power_import_fee != 0) | (grid_power_export_fee != 0)
+    add_rows(lp, 'grid_power_cost', 'T', [(CGP, 1.0), (CGPI, -1.0), (CGPE, -1.0)], 0.0, 0.0, where=power)
+
+    # Max grid cost
+    months = CGPM[np.array([month_pos[m] for m in month_order])]
+    add_rows(lp, 'max_grid_power_cost', 'T', [(months, 1.0), (CGP, -1.0)], 0.0, np.inf, where=power)
+
+    # Costs of the skipped rows are 0
+    fix_column(lp, CGEI[grid_energy_import_fee == 0], 0.0)
+    fix_column(lp, CGEE[grid_energy_export_fee == 0], 0.0)
+    fix_column(lp, CGPI[grid_power_import_fee == 0], 0.0)
+    fix_column(lp, CGPE[grid_power_export_fee == 0], 0.0)
+    fix_column(lp, CGP[~power], 0.0)
+    fix_column(lp, np.setdiff1d(CGPM, months[power]), 0.0)
+
+
+
+def tariff_results(solution, s):
+
+    s['cost_total'] = value(sum(solution.COST_ENERGY[t] + solution.COST_GRID_ENERGY_IMPORT[t] - solution.COST_GRID_ENERGY_EXPORT[t] for t in solution.T) \
+        + sum(solution.COST_GRID_POWER_MAX[m] for m in solution.M) + solution.COST_GRID_FIXED) + sum(s['cost_degradation'])
+
+    s['cost_grid_energy_import'] = value(solution.COST_GRID_ENERGY_IMPORT[:])
+    s['cost_grid_energy_export'] = value(solution.COST_GRID_ENERGY_EXPORT[:])
+    s['cost_grid_power'] = value(solution.COST_GRID_POWER[:])
+    s['cost_grid_power_max'] = value(solution.COST_GRID_POWER_MAX[:])
+    s['cost_grid_power_fixed'] = value(solution.COST_GRID_FIXED)
+
+
+def tariff_sensitivities(solution, s):
+    # The tariff has no sizing input, only the shared marginal values are reported
+    pass
+
+
+
+def tariff_analytic(model_data, p_buy, p_sell):
+
+    # Closed form for a given grid exchange, None for negative energy fees
+    d = model_data[None]
+    fee = {name: lp_series(model_data, name) for name in SERIES if name != 'month_order'}
+    if d['import_penalty'] < 0 or fee['grid_energy_import_fee'].min() < 0 or fee['grid_energy_export_fee'].min() < 0:
+        return None
+
+    month_order = lp_series(model_data, 'month_order').astype(np.int64)
+    months = tariff_sets(model_data)['M']
+    power = (fee['grid_power_import_fee'] != 0) | (fee['grid_power_export_fee'] != 0)
+
+    cost_import = fee['grid_energy_import_fee']*p_buy*d['dt']
+    cost_export = fee['grid_energy_export_fee']*p_sell*d['dt']
+    cost_power = np.maximum(fee['grid_power_import_fee']*(p_buy - p_sell), 0.0) \
+        + np.maximum(fee['grid_power_export_fee']*(p_sell - p_buy), 0.0)
+    cost_power_max = np.array([cost_power[power & (month_order == m)].max(initial=0.0) for m in months])
+    cost_fixed = float(d['grid_fixed_fee']*len(months))
+    cost_energy = (lp_series(model_data, 'energy_price_buy')*p_buy - lp_series(model_data, 'energy_price_sell')*p_sell)*d['dt']
+
+    s = dict()
+    s['cost_total'] = float((cost_energy + cost_import - cost_export).sum() + cost_power_max.sum() + cost_fixed)
+    s['cost_grid_energy_import'] = cost_import.tolist()
+    s['cost_grid_energy_export'] = cost_export.tolist()
+    s['cost_grid_power'] = cost_power.tolist()
+    s['cost_grid_power_max'] = cost_power_max.tolist()
+    s['cost_grid_power_fixed'] = cost_fixed
+
+    return s
@@ -1,6 +1,7 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 from model import microgrid_model, microgrid_data_input, solve_model, microgrid_results, microgrid_results_analysis
+from solver_backend import default_solver
 
 
 # Import data
@@ -31,8 +32,8 @@ df['price_sell_euros_kWh'] = 0.141895 #€/kWh
 
 
 # Simulation data
-data = {'generation': df['pv_power_kW'].to_list(),                  \
-        'demand': df['load_power_kW'].to_list(),                    \
+data = {'generation': df['pv_power_kW'],                            \
+        'demand': df['load_power_kW'],                              \
         'battery_min_level': 0.1,                                   \
         'battery_capacity': 100,                                    \
         'battery_charge_max': 50,                                   \
@@ -41,8 +42,8 @@ data = {'generation': df['pv_power_kW'].to_list(),                  \
         'battery_efficiency_discharge': 0.9,                        \
         'bel_ini_level': 0.5,                                       \
         'bel_fin_level': 0.5,                                       \
-        'energy_price_buy': df['price_buy_euros_kWh'].to_list(),    \
-        'energy_price_sell': df['price_sell_euros_kWh'].to_list(),  \
+        'energy_price_buy': df['price_buy_euros_kWh'],              \
+        'energy_price_sell': df['price_sell_euros_kWh'],            \
         'grid_fee_energy': 0.05,                                    \
         'grid_fee_power': 10,                                       \
         'grid_overcharge_penalty': 20,                              \
@@ -58,8 +59,8 @@ model_data = microgrid_data_input(data)
 # Create model instance with data
 model_instance = microgrid_model(model_data)
 
-# Solve
-solver = {'name':"glpk",'path': "C:/glpk-4.65/w64/glpsol"}
+# Solve (in-process HiGHS, or the solve configuration named by MICROGRID_SOLVER_CONFIG)
+solver = default_solver()
 solution = solve_model(model_instance, solver) 
 
 # Results --> Dictionary
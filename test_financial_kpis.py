@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from financial_kpis import financial_kpis, financial_kpis_batch
+
+
+
+# financial_kpis_batch must give the results of financial_kpis row by row.
+#
+# Example
+# python -m pytest -q test_financial_kpis.py
+
+
+# invest_cost, savings, discount_rate, project_lifespan
+PROJECTS = [(2443750, 262800, 0.08, 30),
+            (1000, 200, 0.05, 10),
+            (5000, 100, 0.08, 15),     # IRR below 0
+            (100, 0.5, 0.08, 1),       # IRR below -99%
+            (1e6, 1.0, 0.03, 2),       # IRR close to -100%
+            (100, 500, 0.08, 20),      # payback in the first year
+            (0, 100, 0.08, 10)]        # no investment: no IRR, no ROI
+
+
+
+def test_batch_matches_scalar():
+
+    invest_cost, savings, discount_rate, project_lifespan = map(np.array, zip(*PROJECTS))
+    batch = financial_kpis_batch(invest_cost, savings, discount_rate, project_lifespan)
+
+    for i, project in enumerate(PROJECTS):
+        cf, npv, payback_time, irr, roi_total, roi_annual = financial_kpis(*project)
+        assert batch['npv'][i] == pytest.approx(npv)
+        assert batch['irr'][i] == pytest.approx(irr, nan_ok=True), project
+        assert batch['roi_total'][i] == pytest.approx(roi_total, nan_ok=True)
+        if not isinstance(roi_annual, complex):
+            assert batch['roi_annual'][i] == pytest.approx(roi_annual, nan_ok=True)
+        if isinstance(payback_time, str):
+            assert (batch['payback_time'][i] < 1) == payback_time.startswith('Less')
+        else:
+            assert batch['payback_time'][i] == pytest.approx(payback_time)
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pyomo.core import value
+
+from model import microgrid_model, microgrid_data_input, microgrid_results
+from swedish_tariff_model import netmetering_model, netmetering_model_input, netmetering_model_results
+from model_core import solve_model
+from matrix_model import lp_constraints
+from benchmark import case_data
+
+
+
+# Parity of the two model builders on input.csv: builder='rules' and
+# builder='matrix' must give the same optimum and the same results.
+#
+# Example
+# python -m pytest -q test_matrix_model.py
+
+
+pytest.importorskip('highspy')
+
+SOLVER = {'name': 'highs'}
+INPUT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input.csv')
+
+# Optimal total cost of the cases below
+OBJECTIVE = {'microgrid': 2326.7857, 'netmetering': 2951.9195}
+
+MODELS = {'microgrid': (microgrid_model, microgrid_data_input, microgrid_results),
+          'netmetering': (netmetering_model, netmetering_model_input, netmetering_model_results)}
+
+
+
+def input_data(model):
+
+    # The data of test.py for microgrid, the benchmark tariff for netmetering
+    df = pd.read_csv(INPUT_CSV, header=0, sep=',', index_col=[0])
+    df.index = pd.DatetimeIndex(df.index)
+    return case_data(model, df)
+
+
+@pytest.fixture(scope='module', params=list(MODELS))
+def solved(request):
+
+    build, data_input, results = MODELS[request.param]
+    model_data = data_input(input_data(request.param))
+
+    solved = dict()
+    for builder in ('rules', 'matrix'):
+        model_instance = build(model_data, builder=builder)
+        solve_model(model_instance, SOLVER, tee=False)
+        solved[builder] = (value(model_instance.total_cost), results(model_instance))
+
+    return request.param, solved
+
+
+
+def test_objective(solved):
+
+    model, solved = solved
+    assert solved['rules'][0] == pytest.approx(OBJECTIVE[model], abs=1e-3)
+    assert solved['matrix'][0] == pytest.approx(solved['rules'][0], rel=1e-9)
+
+
+def test_results(solved):
+
+    # The optimum can be degenerate, so only the costs and the energy totals are compared
+    model, solved = solved
+    rules, matrix = solved['rules'][1], solved['matrix'][1]
+    assert rules.keys() == matrix.keys()
+    for key in ('cost_energy', 'cost_degradation'):
+        assert sum(matrix[key]) == pytest.approx(sum(rules[key]), abs=1e-6)
+    net = lambda s: np.sum(s['power_buy']) - np.sum(s['power_sell'])
+    assert net(matrix) == pytest.approx(net(rules), abs=1e-6)
+
+
+def test_deactivated_rows():
+
+    # Deactivated rows must not reach the solver on either path
+    model_data = microgrid_data_input(input_data('microgrid'))
+    cost = dict()
+    for builder in ('rules', 'matrix'):
+        model_instance = lp_constraints(microgrid_model(model_data, builder=builder))
+        model_instance.overcharge_import.deactivate()
+        for con in list(model_instance.overcharge_export.values())[::2]:
+            con.deactivate()
+        solve_model(model_instance, SOLVER, tee=False)
+        cost[builder] = value(model_instance.total_cost)
+
+    assert cost['rules'] < OBJECTIVE['microgrid'] - 1.0
+    assert cost['matrix'] == pytest.approx(cost['rules'], rel=1e-9)
+
+
+@pytest.mark.parametrize('model', list(MODELS))
+def test_sensitivities(model):
+
+    # Marginal values from the duals; the final soc is fixed (bel_fin_level > 0)
+    build, data_input, results = MODELS[model]
+    model_data = data_input(input_data(model))
+    solved = dict()
+    for builder in ('rules', 'matrix'):
+        model_instance = build(model_data, builder=builder)
+        solve_model(model_instance, SOLVER, tee=False, duals=True)
+        solved[builder] = results(model_instance)
+
+    rules, matrix = solved['rules'], solved['matrix']
+    keys = [key for key in rules if key.startswith(('marginal_', 'shadow_price_'))]
+    assert 'marginal_battery_capacity' in keys
+    for key in keys:
+        assert np.asarray(matrix[key]) == pytest.approx(np.asarray(rules[key]), abs=1e-6), key
+    if model == 'microgrid':
+        # Finite difference of the total cost in battery_capacity
+        assert rules['marginal_battery_capacity'] == pytest.approx(-0.0217851, abs=1e-6)
@@ -0,0 +1,57 @@
+import pytest
+from pyomo.core import value
+
+from model import microgrid_model, microgrid_data_input
+from model_core import solve_model
+from solver_session import SolverSession, PAST_DECISIONS
+from test_matrix_model import input_data, SOLVER
+
+
+
+# Intraday re-dispatch with SolverSession.fix_past: a measured soc that differs
+# from the plan must be taken as the state of the rest of the horizon.
+#
+# Example
+# python -m pytest -q test_solver_session.py
+
+
+pytest.importorskip('highspy')
+
+PERIODS = 192
+
+
+def two_days():
+    data = input_data('microgrid')
+    return {k: v[:PERIODS] if getattr(v, 'shape', ()) == (len(data['demand']),) else v for k, v in data.items()}
+
+
+
+def test_measured_soc():
+
+    model_data = microgrid_data_input(two_days())
+    model_instance = microgrid_model(model_data, mutable=True)
+    session = SolverSession(model_instance, {'name': 'appsi_highs'})
+    session.solve()
+
+    T = list(model_instance.T)
+    planned = {name: {t: getattr(model_instance, name)[t].value for t in T[:40]} for name in PAST_DECISIONS}
+    measured = planned['BEL'][T[39]] + 5.0
+    session.fix_past(T[40], realized={'BEL': {T[39]: measured}})
+    session.solve()
+    assert model_instance.BEL[T[39]].value == pytest.approx(measured)
+
+    # Same past in a fresh model: realized decisions fixed, balance rows of the past dropped
+    reference = microgrid_model(model_data)
+    for name in PAST_DECISIONS:
+        for t, v in planned[name].items():
+            getattr(reference, name)[t].fix(v)
+        reference.BEL[T[39]].fix(measured)
+    for t in T[:40]:
+        reference.battery_soc[t].deactivate()
+    solve_model(reference, SOLVER, tee=False)
+    assert value(model_instance.total_cost) == pytest.approx(value(reference.total_cost), abs=1e-6)
+
+    # A later update fixes the periods in between
+    session.fix_past(T[60])
+    session.solve()
+    assert model_instance.BEL[T[59]].fixed